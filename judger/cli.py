@@ -5,154 +5,127 @@
 """
 
 import argparse
+import os
 import sys
 import subprocess
-import threading
 
+from flask import Flask
 from judger.manager import create_app as create_manager_app
 from judger.executor import create_app as create_executor_app
 
 
-def run_distribute_script():
-    """运行分发脚本"""
-    # 导入并运行分发脚本
-    from judger.manager.distribute import distribute_tasks
-    distribute_tasks()
+def spawn_auxiliary_script(module: str) -> subprocess.Popen:
+    """
+    在子进程中运行辅助脚本（分发脚本或上报脚本）
 
+    调试模式和生产模式都使用子进程，避免辅助脚本与 Flask 应用在同一个解释器中争抢 GIL。
+    子进程位于新的会话中，终端的 Ctrl-C 只会发给 Flask 应用，由调用者负责终止子进程。
 
-def run_reporter_script():
-    """运行上报脚本"""
-    # 导入并运行上报脚本
-    from judger.executor.reporter import StatusReporter
-    reporter = StatusReporter()
-    reporter.start()
+    :param module: 辅助脚本的模块名
+    :return: 子进程对象
+    """
+    return subprocess.Popen([sys.executable, '-m', module], start_new_session=True)
 
 
-def manager() -> None:
-    """启动管理节点（Flask 应用 + 分发脚本）"""
-    parser = argparse.ArgumentParser(description='启动 OJ 评测系统管理节点')
+def is_reloader_child() -> bool:
+    """
+    判断当前进程是否是 Flask 调试模式下由重载器启动的子进程，该子进程不应该再启动辅助脚本
+
+    :return: 是否是重载器启动的子进程
+    """
+    return os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+
+
+def add_common_arguments(parser: argparse.ArgumentParser, port: int, workers: int) -> None:
+    """
+    添加管理节点和执行节点共用的命令行参数
+
+    :param parser: 命令行参数解析器
+    :param port: 默认监听端口
+    :param workers: 默认工作进程数
+    """
     parser.add_argument('--host', default='127.0.0.1', help='监听地址 (默认: %(default)s)')
-    parser.add_argument('--port', type=int, default=10010, help='监听端口 (默认: %(default)s)')
+    parser.add_argument('--port', type=int, default=port, help='监听端口 (默认: %(default)s)')
     parser.add_argument('--debug', action='store_true', help='启用调试模式')
-    parser.add_argument('--workers', type=int, default=1, help='工作进程数 (默认: %(default)s)')
+    parser.add_argument(
+        '--workers', type=int, default=workers, help='工作进程数 (默认: %(default)s)'
+    )
+    parser.add_argument(
+        '--worker-class', default='gthread', help='gunicorn 工作进程类型 (默认: %(default)s)'
+    )
+    parser.add_argument(
+        '--threads', type=int, default=4, help='每个工作进程的线程数 (默认: %(default)s)'
+    )
+
+
+def run_gunicorn(app: Flask, args: argparse.Namespace) -> None:
+    """
+    在生产模式下使用 gunicorn 运行 Flask 应用，gunicorn 只在这里才被导入
+
+    :param app: 要运行的 Flask 应用
+    :param args: 命令行参数
+    """
+    from judger.wsgi import StandaloneApplication
+
+    options = {
+        'bind': f'{args.host}:{args.port}',
+        'workers': args.workers,
+        'worker_class': args.worker_class,
+        'threads': args.threads,
+        'timeout': 120,
+        # 允许多个监听套接字绑定同一端口，由内核在它们之间分配新连接
+        'reuse_port': True,
+    }
+    StandaloneApplication(app, options).run()
+
+
+def run_node(app: Flask, args: argparse.Namespace, auxiliary_module: str) -> None:
+    """
+    运行节点的 Flask 应用，同时在子进程中运行它的辅助脚本
+
+    :param app: 要运行的 Flask 应用
+    :param args: 命令行参数
+    :param auxiliary_module: 辅助脚本的模块名
+    """
+    # 启动辅助脚本子进程
+    auxiliary_process = None
+    owner_pid = os.getpid()
+    if not is_reloader_child():
+        auxiliary_process = spawn_auxiliary_script(auxiliary_module)
+
+    try:
+        if args.debug:
+            # 在调试模式下，直接运行 Flask 应用
+            app.run(host=args.host, port=args.port, debug=True)
+        else:
+            # 在生产模式下，使用 gunicorn 运行 Flask 应用
+            run_gunicorn(app, args)
+    finally:
+        # 确保 Flask 应用关闭时，辅助脚本子进程也被终止；
+        # gunicorn 的工作进程退出时也会执行到这里，只有启动子进程的进程才能终止它
+        if auxiliary_process is not None and os.getpid() == owner_pid:
+            auxiliary_process.terminate()
+            auxiliary_process.wait()
 
-    args = parser.parse_args()
 
-    app = create_manager_app()
-
-    # 在调试模式下，直接运行 Flask 应用和分发脚本
-    if args.debug:
-        # 创建并启动分发脚本线程
-        distribute_thread = threading.Thread(target=run_distribute_script)
-        distribute_thread.daemon = True
-        distribute_thread.start()
+def manager() -> None:
+    """启动管理节点（Flask 应用 + 分发脚本）"""
+    parser = argparse.ArgumentParser(description='启动 OJ 评测系统管理节点')
+    add_common_arguments(parser, port=10010, workers=2 * (os.cpu_count() or 1) + 1)
+    args = parser.parse_args()
 
-        # 运行 Flask 应用
-        app.run(host=args.host, port=args.port, debug=True)
-    else:
-        # 在生产模式下，使用 gunicorn 运行 Flask 应用，并在子进程中运行分发脚本
-        # 启动分发脚本子进程
-        distribute_process = subprocess.Popen([
-            sys.executable, '-c',
-            'from judger.manager.distribute import distribute_tasks; distribute_tasks()'
-        ])
-
-        try:
-            # 运行 Flask 应用
-            import gunicorn.app.base
-
-            class StandaloneApplication(gunicorn.app.base.BaseApplication):
-                def __init__(self, app, options=None):
-                    self.options = options or {}
-                    self.application = app
-                    super().__init__()
-
-                def load_config(self):
-                    config = {
-                        key: value for key, value in self.options.items()
-                        if key in self.cfg.settings and value is not None
-                    }
-                    for key, value in config.items():
-                        self.cfg.set(key.lower(), value)
-
-                def load(self):
-                    return self.application
-
-            options = {
-                'bind': f'{args.host}:{args.port}',
-                'workers': args.workers,
-                'worker_class': 'sync',
-                'timeout': 120,
-            }
-            StandaloneApplication(app, options).run()
-        finally:
-            # 确保 Flask 应用关闭时，分发脚本子进程也被终止
-            distribute_process.terminate()
-            distribute_process.wait()
+    run_node(create_manager_app(), args, 'judger.manager.distribute')
 
 
 def executor() -> None:
     """启动执行节点（Flask 应用 + 上报脚本）"""
     parser = argparse.ArgumentParser(description='启动 OJ 评测系统执行节点')
-    parser.add_argument('--host', default='127.0.0.1', help='监听地址 (默认: %(default)s)')
-    parser.add_argument('--port', type=int, default=10011, help='监听端口 (默认: %(default)s)')
-    parser.add_argument('--debug', action='store_true', help='启用调试模式')
-    parser.add_argument('--workers', type=int, default=1, help='工作进程数 (默认: %(default)s)')
-
+    # 执行节点同一时间只会被分配一个评测任务，每个工作进程还各有一个验证进程池，
+    # 所以默认只用一个工作进程，用多个线程处理等待网络的请求
+    add_common_arguments(parser, port=10011, workers=1)
     args = parser.parse_args()
 
-    app = create_executor_app()
-
-    # 在调试模式下，直接运行 Flask 应用和上报脚本
-    if args.debug:
-        # 创建并启动上报脚本线程
-        reporter_thread = threading.Thread(target=run_reporter_script)
-        reporter_thread.daemon = True
-        reporter_thread.start()
-
-        # 运行 Flask 应用
-        app.run(host=args.host, port=args.port, debug=True)
-    else:
-        # 在生产模式下，使用 gunicorn 运行 Flask 应用，并在子进程中运行上报脚本
-        # 启动上报脚本子进程
-        reporter_process = subprocess.Popen([
-            sys.executable, '-c',
-            'from judger.executor.reporter import StatusReporter; '
-            'reporter = StatusReporter(); reporter.start()'
-        ])
-
-        try:
-            # 运行 Flask 应用
-            import gunicorn.app.base
-
-            class StandaloneApplication(gunicorn.app.base.BaseApplication):
-                def __init__(self, app, options=None):
-                    self.options = options or {}
-                    self.application = app
-                    super().__init__()
-
-                def load_config(self):
-                    config = {
-                        key: value for key, value in self.options.items()
-                        if key in self.cfg.settings and value is not None
-                    }
-                    for key, value in config.items():
-                        self.cfg.set(key.lower(), value)
-
-                def load(self):
-                    return self.application
-
-            options = {
-                'bind': f'{args.host}:{args.port}',
-                'workers': args.workers,
-                'worker_class': 'sync',
-                'timeout': 120,
-            }
-            StandaloneApplication(app, options).run()
-        finally:
-            # 确保 Flask 应用关闭时，上报脚本子进程也被终止
-            reporter_process.terminate()
-            reporter_process.wait()
+    run_node(create_executor_app(), args, 'judger.executor.reporter')
 
 
 if __name__ == '__main__':
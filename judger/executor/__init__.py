@@ -1,10 +1,19 @@
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple, Callable
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, Blueprint, current_app, jsonify
 from judger.utils.token_manager import TokenManager
 from judger.utils.api_client import APIRequestError, APIClient
 from judger.utils.template_manager import TemplateManager
+from judger.utils.dir_reaper import DirectoryReaper
 from judger.executor.config import Config
+from judger.executor.validator_pool import ValidatorPool
+import os
 import shutil
+import tempfile
+import threading
+import time
+import zipfile
 import logging
 from logging import Formatter
 from pathlib import Path
@@ -13,6 +22,122 @@ from pathlib import Path
 bp = Blueprint('judge', __name__, url_prefix='/api/judge')
 
 
+def _extract_submission(zip_file: zipfile.ZipFile, extract_dir: Path) -> None:
+    """
+    将提交的源代码包解压到由模板复制出的目录中
+
+    :param zip_file: 源代码包
+    :param extract_dir: 解压目录
+    """
+    # 与 zipfile 计算解压路径的规则一致：去掉绝对路径前缀和 . / .. 部分
+    directories = set()
+    files = []
+    for member in zip_file.infolist():
+        parts = [part for part in member.filename.split('/') if part not in ('', '.', '..')]
+        target = extract_dir.joinpath(*parts)
+        if member.is_dir():
+            directories.add(target)
+        else:
+            directories.add(target.parent)
+            files.append((member, target))
+
+    # 每个目录只创建一次，而不是解压每个文件时都检查一遍
+    for directory in sorted(directories):
+        directory.mkdir(parents=True, exist_ok=True)
+
+    for member, target in files:
+        if target.is_symlink():
+            # 不能通过符号链接写入评测目录之外的文件
+            target.unlink()
+        with zip_file.open(member) as source, target.open('wb') as destination:
+            shutil.copyfileobj(source, destination)
+
+
+def _filesystem_type(path: Path) -> Optional[str]:
+    """
+    从 /proc/mounts 中查找路径所在文件系统的类型
+
+    :param path: 要查找的路径
+    :return: 文件系统类型（如 `tmpfs`、`ext4`），无法读取挂载信息时返回 None
+    """
+    path = os.path.realpath(path)
+    fs_type, mount_point_len = None, -1
+    try:
+        with open('/proc/mounts') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                # 挂载点中的空格等字符以八进制转义的形式出现
+                mount_point = fields[1].encode().decode('unicode_escape')
+                # 取包含该路径的最长挂载点
+                if (os.path.commonpath([path, mount_point]) == mount_point
+                        and len(mount_point) > mount_point_len):
+                    fs_type, mount_point_len = fields[2], len(mount_point)
+    except OSError:
+        return None
+    return fs_type
+
+
+def _with_app_context(app: Flask, func: Callable[..., Any], *args: Any) -> Any:
+    """
+    在应用上下文中调用函数，用于在线程池中发送需要读取应用配置的 API 请求
+
+    :param app: Flask 应用
+    :param func: 要调用的函数
+    :param args: 函数的参数
+    :return: 函数的返回值
+    """
+    with app.app_context():
+        return func(*args)
+
+
+def _get_problem_data(api_client: APIClient, problem_id: int, endpoint: str) -> Any:
+    """
+    获取题目的信息（如题目信息、函数需求信息），`PROBLEM_CACHE_TTL` 秒内重复使用缓存的结果。
+    缓存最多保存 `PROBLEM_CACHE_SIZE` 道题目，写入时淘汰过期的和最久未使用的题目。
+
+    :param api_client: 访问 Web 服务端的 API 客户端
+    :param problem_id: 题目 ID
+    :param endpoint: 要请求的 API 端点路径，必须只依赖题目 ID
+    :return: 解析 JSON 响应体得到的数据
+    :raises APIRequestError: 当缓存未命中且请求失败时抛出
+    """
+    now = time.monotonic()
+    cache = current_app.problem_cache
+    with current_app.problem_cache_lock:
+        cached = cache.get(problem_id, {}).get(endpoint)
+        if cached is not None and cached[0] > now:
+            cache.move_to_end(problem_id)
+            return cached[1]
+
+    data = api_client.get(endpoint)
+    expire_at = now + current_app.config['PROBLEM_CACHE_TTL']
+    with current_app.problem_cache_lock:
+        cache.setdefault(problem_id, {})[endpoint] = (expire_at, data)
+        cache.move_to_end(problem_id)
+        # 淘汰所有信息都已过期的题目，题目数仍然超出上限时淘汰最久未使用的题目
+        for expired_id in [
+            cached_id for cached_id, entries in cache.items()
+            if all(entry[0] <= now for entry in entries.values())
+        ]:
+            del cache[expired_id]
+        while len(cache) > current_app.config['PROBLEM_CACHE_SIZE']:
+            cache.popitem(last=False)
+    return data
+
+
+@bp.route('/invalidate/<int:problem_id>', methods=['POST'])
+def invalidate_problem(problem_id: int):
+    """
+    清除题目信息和函数需求信息的缓存，Web 服务端修改题目后可以调用此 API 使修改立即生效
+    """
+    with current_app.problem_cache_lock:
+        current_app.problem_cache.pop(problem_id, None)
+    current_app.logger.info('cache of problem %d invalidated', problem_id)
+    return '', 200
+
+
 @bp.route('/<int:judgment_id>', methods=['POST'])
 def judge_judgment(judgment_id):
     """处理评测请求
@@ -24,111 +149,122 @@ def judge_judgment(judgment_id):
     try:
         # 获取API客户端和模板管理器
         api_client = APIClient(current_app.token_manager)
-        template_manager = TemplateManager(api_client)
+        template_manager: TemplateManager = current_app.template_manager
 
         # 通过judgment_id获取submission_id
         judgment_info = api_client.get(f'/api/judgments/{judgment_id}')
         submission_id = judgment_info['submission_id']
-        current_app.logger.info(f'submission info obtained: ID {submission_id}')
+        current_app.logger.info('submission info obtained: ID %s', submission_id)
 
-        # 获取题目信息
-        submission_info: Dict[str, Any] = api_client.get(f'/api/submissions/{submission_id}')
-        problem_info: Dict[str, Any] = api_client.get(
-            f'/api/problems/{submission_info["problem_id"]}'
-        )
-        has_autograder = problem_info.get('has_autograder', False)
-        unit_test_name = problem_info.get('unit_test_name', '') if has_autograder else None
-        current_app.logger.info(f'problem info obtained, has autograder: {has_autograder}')
+        # 提交信息和源代码附件信息互不依赖，并发请求以节省往返时间
+        app = current_app._get_current_object()
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            submission_future = pool.submit(
+                _with_app_context, app, api_client.get, f'/api/submissions/{submission_id}'
+            )
+            code_future = pool.submit(
+                _with_app_context, app, api_client.get, f'/api/submissions/{submission_id}/code'
+            )
+            submission_info: Dict[str, Any] = submission_future.result()
+            code_info = code_future.result()
 
-        # 获取源代码附件ID
-        code_info = api_client.get(f'/api/submissions/{submission_id}/code')
-        attachment_id = code_info['attachment_id']
-        current_app.logger.info(f'source code attachment ID is {attachment_id}')
+            # 题目信息和函数需求信息都只依赖题目 ID，同样并发请求
+            problem_id = submission_info['problem_id']
+            problem_future = pool.submit(
+                _with_app_context, app, _get_problem_data,
+                api_client, problem_id, f'/api/problems/{problem_id}'
+            )
+            functions_future = pool.submit(
+                _with_app_context, app, _get_problem_data,
+                api_client, problem_id, f'/api/problems/{problem_id}/functions'
+            )
+            problem_info = problem_future.result()
+            has_autograder = problem_info.get('has_autograder', False)
+            unit_test_name = problem_info.get('unit_test_name', '') if has_autograder else None
+            current_app.logger.info('problem info obtained, has autograder: %s', has_autograder)
 
-        # 下载ZIP文件
-        tmp_dir = Path(current_app.config["TMP_DIR"])
-        zip_path = tmp_dir / f'submission_{submission_id}.zip'
-        response = api_client.get(
-            f'/api/submissions/attachments/{attachment_id}',
-            parse_json=False,
-            stream=True
-        )
+            attachment_id = code_info['attachment_id']
+            current_app.logger.info('source code attachment ID is %s', attachment_id)
 
-        # 保存ZIP文件
-        current_app.logger.info('start downloading source code pack...')
-        with zip_path.open('wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        current_app.logger.info(f'source code pack saved to {zip_path}')
+            # 获取函数需求信息
+            function_requirements = None
+            try:
+                function_requirements = functions_future.result()
+                if isinstance(function_requirements, list) and len(function_requirements) > 0:
+                    current_app.logger.info(
+                        'found %d function requirements', len(function_requirements)
+                    )
+                else:
+                    current_app.logger.info(
+                        'problem %s does not have function implementation', problem_id
+                    )
+                    function_requirements = None
+            except Exception as e:
+                current_app.logger.error(
+                    'failed to obtain function requirements: %s %s', type(e), e
+                )
+                raise RuntimeError('failed to obtain function requirements')
 
         # 准备临时目录
+        tmp_dir = Path(current_app.config["TMP_DIR"])
         temp_dir = tmp_dir / f'judgement_for_{judgment_id}'
         if temp_dir.exists():
-            shutil.rmtree(temp_dir)
-        current_app.logger.info(f'temp directory for judgment: {temp_dir}')
+            current_app.dir_reaper.discard(temp_dir)
+        current_app.logger.info('temp directory for judgment: %s', temp_dir)
 
         # 获取远程模板
         current_app.logger.info('preparing project template...')
-        template_info = template_manager.get_template(problem_info['template_id'])
+        template_id = problem_info['template_id']
+        try:
+            template_info = template_manager.get_template(template_id)
+        except APIRequestError as e:
+            # Web 服务端暂时不可用时，退回到最近一次成功获取的模板，而不是让评测失败
+            template_info = template_manager.get_cached_template(template_id)
+            if template_info is None:
+                raise
+            current_app.logger.warning(
+                'failed to check template %s, using cached one: %s', template_id, e
+            )
         template_dir = template_info['path']
-        shutil.copytree(template_dir, temp_dir)
+        # 必须真正复制模板文件：编译和解压都会原地改写评测目录中的文件，
+        # 与缓存的模板共享 inode（如硬链接）会把改动写回缓存；
+        # 复制期间持有模板的读者锁，其他线程或工作进程不会在复制到一半时替换模板
+        with template_manager.reading(template_id):
+            shutil.copytree(template_dir, temp_dir)
 
-        # 解压到临时目录的模板中
-        shutil.unpack_archive(
-            filename=zip_path, extract_dir=temp_dir, format='zip'
+        # 下载ZIP文件并直接解压到临时目录的模板中，较小的源代码包只在内存中缓冲，不落盘
+        response = api_client.get(
+            f'/api/submissions/attachments/{attachment_id}',
+            parse_json=False,
+            stream=True,
+            # ZIP 文件本身已经压缩过，不需要 HTTP 层再压缩一次
+            headers={'Accept-Encoding': 'identity'}
         )
-        zip_path.unlink()
-        current_app.logger.info(f'{zip_path} unpacked to {temp_dir}')
+        current_app.logger.info('start downloading source code pack...')
+        with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as zip_buffer:
+            response.raw.decode_content = True
+            shutil.copyfileobj(response.raw, zip_buffer, length=1024 * 1024)
+            zip_buffer.seek(0)
+            with zipfile.ZipFile(zip_buffer) as zip_file:
+                _extract_submission(zip_file, temp_dir)
+        current_app.logger.info('source code pack unpacked to %s', temp_dir)
 
-        # 在启动子进程前，获取函数需求信息
-        function_requirements = None
-        try:
-            import json
-            function_requirements = api_client.get(
-                '/api/problems/{}/functions'.format(problem_info['id'])
-            )
-            # 如果有函数需求，则序列化并传递给子进程
-            if isinstance(function_requirements, list) and len(function_requirements) > 0:
-                current_app.logger.info(
-                    f'found {len(function_requirements)} function requirements'
-                )
-                function_requirements = json.dumps(function_requirements)
-            else:
-                current_app.logger.info(
-                    f'problem {problem_info["id"]} does not have function implementation'
-                )
-                function_requirements = None
-        except Exception as e:
-            current_app.logger.error(f'failed to obtain function requirements: {type(e)} {str(e)}')
-            raise RuntimeError('failed to obtain function requirements')
-
-        # 异步启动验证脚本
-        import subprocess
-        import sys
-        validator_path = Path(__file__).parent / 'validate.py'
-        args = [
-            sys.executable,
-            str(validator_path),
-            '--judgment-id', str(judgment_id),
-            '--temp-dir', str(temp_dir)
-        ]
-        if unit_test_name:
-            args.extend(['--unit-test', unit_test_name])
-        # 如果有函数需求信息，添加到命令行参数
-        if function_requirements:
-            args.extend(['--function-requirements', function_requirements])
-
-        current_app.logger.debug(' '.join(args))
-        subprocess.Popen(args)
+        # 将评测任务交给常驻的验证进程异步执行
+        current_app.validator_pool.submit({
+            'judgment_id': judgment_id,
+            'temp_dir': str(temp_dir),
+            'unit_test': unit_test_name,
+            'function_requirements': function_requirements
+        })
         current_app.logger.info('validation started')
 
         return jsonify(''), 202
 
     except APIRequestError as e:
-        current_app.logger.error(f'Web API request error: {str(e)}')
+        current_app.logger.error('Web API request error: %s', e)
         return jsonify(error_message=str(e)), 500
     except Exception as e:
-        current_app.logger.error(f'unexpected error before start judging: {str(e)}')
+        current_app.logger.error('unexpected error before start judging: %s', e)
         return jsonify(error_message=f'unexpected error: {str(e)}'), 500
 
 
@@ -144,6 +280,22 @@ def create_app(test_config: Optional[Dict] = None) -> Flask:
     for handler in app.logger.handlers:
         handler.setFormatter(formatter)
     app.logger.setLevel(logging.INFO)
+    app.validator_pool = ValidatorPool(app.config['VALIDATOR_WORKERS'])
+    # 模板、题目信息和函数需求信息的缓存在整个应用生命周期内有效
+    app.template_manager = TemplateManager(APIClient(app.token_manager))
+    # {题目 ID: {API 端点路径: (过期时间, 数据)}}
+    app.problem_cache: OrderedDict[int, Dict[str, Tuple[float, Any]]] = OrderedDict()
+    app.problem_cache_lock = threading.Lock()
+    app.dir_reaper = DirectoryReaper()
+    # 上次运行时进程在删除完成之前退出，遗留下的评测目录
+    app.dir_reaper.sweep(Path(app.config['TMP_DIR']))
+    # 编译过程会写入大量小文件，TMP_DIR 在 tmpfs 上时这些写入不必等待磁盘
+    tmp_fs_type = _filesystem_type(Path(app.config['TMP_DIR']))
+    if tmp_fs_type is not None and tmp_fs_type != 'tmpfs':
+        app.logger.warning(
+            'TMP_DIR %s is on %s instead of tmpfs, compiling may be slowed down by disk I/O',
+            app.config['TMP_DIR'], tmp_fs_type
+        )
     log_dir = Path(app.config['LOG_DIR'])
     # 创建执行评测的日志目录
     if not log_dir.exists():
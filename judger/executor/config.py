@@ -3,18 +3,26 @@ import os
 
 class Config:
     MANAGER_IP = os.environ.get('MANAGER_IP') or '127.0.0.1'
-    MANAGER_PORT = os.environ.get('MANAGER_PORT') or '10010'
+    MANAGER_PORT = int(os.environ.get('MANAGER_PORT') or 10010)
     # 向管理节点上报状态的时间间隔（以分钟计），如果网络环境稳定可以适当增大
-    KEEP_ALIVE_INTERVAL = os.environ.get('KEEP_ALIVE_INTERVAL') or 1
+    KEEP_ALIVE_INTERVAL = int(os.environ.get('KEEP_ALIVE_INTERVAL') or 1)
     WEB_SERVER_IP = os.environ.get('WEB_SERVER_IP') or '127.0.0.1'
-    WEB_SERVER_PORT = os.environ.get('WEB_SERVER_PORT') or '8000'
+    WEB_SERVER_PORT = int(os.environ.get('WEB_SERVER_PORT') or 8000)
     # 登录 Web 服务端的账号和密码
     WEB_ACCOUNT = os.environ.get('WEB_ACCOUNT')
     WEB_PASSWORD = os.environ.get('WEB_PASSWORD')
     # 编译项目时启动的线程数，默认等于 CPU 核数，若获取不到核数则为 4
-    PARALLEL_BUILD = os.environ.get('PARALLEL_BUILD') or os.cpu_count() or 4
+    PARALLEL_BUILD = int(os.environ.get('PARALLEL_BUILD') or os.cpu_count() or 4)
+    # 常驻验证进程的数量，管理节点同一时间只会给一个执行节点分配一个评测任务，所以默认为 1
+    VALIDATOR_WORKERS = int(os.environ.get('VALIDATOR_WORKERS') or 1)
+    # 题目信息和函数需求信息的缓存时间（以秒计）
+    PROBLEM_CACHE_TTL = int(os.environ.get('PROBLEM_CACHE_TTL') or 300)
+    # 最多缓存多少道题目的信息，超出时淘汰最久未使用的题目
+    PROBLEM_CACHE_SIZE = int(os.environ.get('PROBLEM_CACHE_SIZE') or 128)
     # 临时存放解压后的模板和提交内容
     TMP_DIR = os.environ.get('TMP_DIR') or '/tmp'
+    # 编译缓存 ccache 的缓存目录，所有评测共享；安装了 ccache 且该目录可写时才会使用
+    CCACHE_DIR = os.environ.get('CCACHE_DIR') or os.path.expanduser('~/.cache/oj-ccache')
     LOG_FORMAT = '[%(levelname)s][%(name)s][%(asctime)s] %(message)s'
     # 存放每个评测的日志信息
     LOG_DIR = os.environ.get('LOG_DIR') or '/var/log/judgment'
@@ -4,20 +4,253 @@
 该模块负责使用 libclang 从 C++ 源文件中提取指定函数的完整实现。
 """
 
+import atexit
+import functools
+import hashlib
 import logging
+import os
+import shutil
 import subprocess
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple, Set, Any
 from clang.cindex import (
-    Index, Cursor, CursorKind, Type, TranslationUnit,
-    CompilationDatabase, CompileCommand
+    Index, Cursor, CursorKind, TranslationUnit, TranslationUnitLoadError, Diagnostic,
+    CompilationDatabase, CompileCommand, SourceLocation, SourceRange, conf, callbacks
 )
+from judger.executor.config import Config
 from judger.executor.function_types import FunctionSignature
+from judger.executor.mp_context import get_mp_context
 
 
 logger = logging.getLogger('function_extractor')
 
 
+@functools.lru_cache(maxsize=4)
+def _discover_system_include_paths(clang_exe: str, mtime: float) -> Tuple[str, ...]:
+    """
+    调用 clang++ 获取标准库 include path。
+
+    同一个编译器的输出不会变化，所以结果按编译器路径和修改时间缓存，
+    在整个进程中只需要调用一次 clang++。
+
+    :param clang_exe: clang++ 可执行文件的真实路径
+    :param mtime: clang++ 可执行文件的修改时间，编译器被更新后缓存自动失效
+    :return: 标准库 include path
+    :raises RuntimeError: 当无法获取 include path 时抛出
+    """
+    start_marker = '#include <...> search starts here:'
+    end_marker = 'End of search list.'
+    try:
+        # 调用 clang++ 命令获取标准库搜索路径，只做语法检查而不输出预处理结果；逐行读取它的输出，
+        # 读到搜索路径的结束标记后就终止进程，不必等待它完成剩下的工作
+        with subprocess.Popen(
+            [clang_exe, '-fsyntax-only', '-x', 'c++', '-', '-v'],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True
+        ) as process:
+            paths = None
+            for line in process.stderr:
+                line = line.strip()
+                if paths is None:
+                    if line == start_marker:
+                        paths = []
+                elif line == end_marker:
+                    process.terminate()
+                    return tuple(paths)
+                elif line and not line.startswith('ignoring nonexistent directory'):
+                    paths.append(line)
+
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, process.args)
+        if paths is None:
+            raise RuntimeError('beginning of include paths not found in clang++ output')
+        raise RuntimeError('end of include paths not found in clang++ output')
+
+    except subprocess.CalledProcessError as e:
+        logger.error(f'failed to call clang++: {e}')
+        raise RuntimeError(f'cannot find system include path: {e}') from e
+    except Exception as e:
+        logger.error(f'unexpected error occurred when finding system include path: {e}')
+        raise RuntimeError(f'unexpected error occurred when finding include path: {e}') from e
+
+
+@functools.lru_cache(maxsize=None)
+def _get_index() -> Index:
+    """
+    获取当前进程共用的 libclang 索引，所有函数提取器都在同一个索引上解析源文件
+
+    :return: libclang 索引
+    """
+    return Index.create()
+
+
+# `clang_visitChildren` 回调函数的返回值：继续访问下一个兄弟节点，或进入当前节点的子节点
+_CHILD_VISIT_CONTINUE = 1
+_CHILD_VISIT_RECURSE = 2
+
+# 预编译为 PCH 的常用标准库头文件。解析源文件时强制包含这个 PCH，不必每次都重新解析这些头文件；
+# 函数提取只在编译通过之后进行，多包含的头文件不会影响提取结果
+_PRELUDE_HEADERS = (
+    'algorithm', 'cmath', 'functional', 'iostream', 'map', 'memory',
+    'set', 'string', 'unordered_map', 'vector',
+)
+# 与具体评测目录有关、不影响标准库头文件解析的编译参数，生成 PCH 时去掉它们以便在多次评测之间复用
+_PCH_IGNORED_ARGS = ('-I', '-iquote', '-o')
+# 生成或使用失败的 PCH，当前进程不再尝试
+_failed_pch: Set[Path] = set()
+
+
+def _get_prelude_pch(index: Index, args: List[str], toolchain: str) -> Optional[Path]:
+    """
+    获取与编译参数和工具链兼容的常用标准库头文件的 PCH，不存在时生成它。
+
+    PCH 文件在执行节点重启后仍然保留，所以它的文件名同时由编译参数和工具链决定，
+    编译器或标准库被更新后会生成新的 PCH，而不是继续使用过期的 PCH。
+
+    :param index: libclang 索引
+    :param args: 解析源文件时使用的编译参数
+    :param toolchain: 工具链标识，见 `FunctionExtractor._get_system_include_paths`
+    :return: PCH 文件路径，无法生成时返回 None
+    """
+    pch_args = []
+    skip_next = False
+    for arg in args:
+        if skip_next:
+            skip_next = False
+        elif arg in _PCH_IGNORED_ARGS:
+            skip_next = True
+        elif not arg.startswith(_PCH_IGNORED_ARGS):
+            pch_args.append(arg)
+
+    pch_dir = Path(Config.TMP_DIR) / 'pch'
+    digest = hashlib.sha256('\0'.join([toolchain, *pch_args]).encode()).hexdigest()
+    pch_path = pch_dir / f'{digest}.pch'
+    if pch_path in _failed_pch:
+        return None
+    if pch_path.exists():
+        return pch_path
+
+    try:
+        pch_dir.mkdir(parents=True, exist_ok=True)
+        prelude_path = pch_dir / f'{digest}.hpp'
+        prelude_path.write_text(''.join(f'#include <{header}>\n' for header in _PRELUDE_HEADERS))
+        tu = index.parse(
+            str(prelude_path),
+            args=['-x', 'c++-header', *pch_args],
+            options=TranslationUnit.PARSE_INCOMPLETE | TranslationUnit.PARSE_SKIP_FUNCTION_BODIES
+        )
+        errors = [diag for diag in tu.diagnostics if diag.severity >= Diagnostic.Error]
+        if errors:
+            raise RuntimeError(f'errors in prelude header: {errors[0]}')
+        # 先保存到临时文件再重命名，其他验证进程不会读到不完整的 PCH
+        temp_path = pch_dir / f'{digest}.{os.getpid()}.tmp'
+        tu.save(str(temp_path))
+        os.replace(temp_path, pch_path)
+    except Exception as e:
+        logger.warning(f'failed to generate precompiled header: {type(e)}: {str(e)}')
+        _failed_pch.add(pch_path)
+        return None
+    logger.info(f'precompiled header generated: {pch_path}')
+    return pch_path
+
+
+def _discard_prelude_pch(pch_path: Path) -> None:
+    """
+    删除不可用的 PCH，当前进程不再使用它，其他进程下次使用时会重新生成
+
+    :param pch_path: PCH 文件路径
+    """
+    _failed_pch.add(pch_path)
+    pch_path.unlink(missing_ok=True)
+
+
+# 可能包含函数声明的节点类型，查找函数时只进入这些节点
+_SCOPE_KINDS = frozenset({
+    CursorKind.NAMESPACE,
+    CursorKind.CLASS_DECL,
+    CursorKind.STRUCT_DECL,
+    CursorKind.CLASS_TEMPLATE,
+    CursorKind.LINKAGE_SPEC,
+    CursorKind.UNEXPOSED_DECL,
+})
+
+# 函数提取结果的缓存，键为 (源文件相对项目目录的路径, 源文件 SHA-256, 编译参数, 函数签名)，
+# 值为 (翻译单元用到的项目文件相对项目目录的路径及其 SHA-256, 函数实现)。
+# 每次评测的项目目录都不同，所以键和值中都不包含项目目录，重新评测相同的代码时不必再次解析
+_implementation_cache: OrderedDict = OrderedDict()
+_IMPLEMENTATION_CACHE_SIZE = 256
+# 编译参数中的项目目录被替换为这个占位符
+_PROJECT_DIR_PLACEHOLDER = '${PROJECT_DIR}'
+
+
+def _read_file(path: Path) -> bytes:
+    """
+    读取文件内容，文件未被修改时直接使用缓存的内容。
+    同一次评测中源文件会被多次读取（计算摘要、解析、提取函数体），只有第一次需要真正读取。
+
+    :param path: 文件路径
+    :return: 文件内容
+    """
+    stat = path.stat()
+    return _read_file_cached(str(path), stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=32)
+def _read_file_cached(path: str, mtime_ns: int, size: int) -> bytes:
+    """按文件路径、修改时间和大小缓存文件内容"""
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _file_digest(path: Path) -> str:
+    """计算文件内容的 SHA-256 摘要"""
+    return hashlib.sha256(_read_file(path)).hexdigest()
+
+
+def _get_cached_implementation(
+    key: Tuple, project_dir: Path
+) -> Optional[Tuple[Tuple, Optional[str]]]:
+    """
+    查找缓存的函数提取结果，翻译单元用到的项目文件（如头文件）在当前项目中不同时视为未命中
+
+    :param key: 缓存键
+    :param project_dir: 当前评测的项目目录
+    :return: 缓存条目，未命中时返回 None
+    """
+    entry = _implementation_cache.get(key)
+    if entry is None:
+        return None
+    for relative_path, digest in entry[0]:
+        path = project_dir / relative_path
+        if not path.is_file() or _file_digest(path) != digest:
+            del _implementation_cache[key]
+            return None
+    _implementation_cache.move_to_end(key)
+    return entry
+
+
+def _cache_implementation(
+    key: Tuple, dependencies: Tuple[Tuple[Path, str], ...], implementation: Optional[str]
+) -> None:
+    """
+    缓存函数提取结果，缓存条目过多时淘汰最久未使用的条目
+
+    :param key: 缓存键
+    :param dependencies: 翻译单元用到的项目文件相对项目目录的路径及其 SHA-256
+    :param implementation: 提取到的函数实现，未找到时为 None
+    """
+    _implementation_cache[key] = (dependencies, implementation)
+    _implementation_cache.move_to_end(key)
+    while len(_implementation_cache) > _IMPLEMENTATION_CACHE_SIZE:
+        _implementation_cache.popitem(last=False)
+
+
 class FunctionExtractor:
     """函数提取器类"""
 
@@ -27,13 +260,18 @@ class FunctionExtractor:
 
         :param build_dir: 构建目录绝对路径，用于查找 compile_commands.json
         """
-        self.index = Index.create()
+        self.index = _get_index()
         self.build_dir = build_dir
         self.compile_db: CompilationDatabase = CompilationDatabase.fromDirectory(build_dir)
         # 系统级 C/C++ 标准库搜索路径，libclang 不是完整编译器，所以需要手动指定这些路径
         self._system_include_paths: Optional[List[str]] = None
-        # 将类型名称映射到 AST 中的类型对象以便和 AST 中的类型游标准确比较
-        self._types: Dict[str, Type] = {}
+        # clang++ 和标准库头文件目录的路径及修改时间，用于区分不同工具链生成的 PCH
+        self._toolchain = ''
+        # 将类型名称映射到其在最近一次解析的源文件中的规范名称，以便和 AST 中的类型游标准确比较；
+        # 只保存字符串而不保存类型对象，不会让已经用完的翻译单元无法释放
+        self._types: Dict[str, str] = {}
+        # 各源文件的完整编译参数（包括系统 include path），同一个源文件只需要构造一次
+        self._args_cache: Dict[Path, List[str]] = {}
         logger.info(f'FunctionExtractor instantiated from build dir {build_dir}')
 
     def _get_system_include_paths(self) -> List[str]:
@@ -46,91 +284,125 @@ class FunctionExtractor:
         if self._system_include_paths is not None:
             return self._system_include_paths
 
-        try:
-            # 调用 clang++ 命令获取标准库搜索路径
-            result = subprocess.run(
-                ['clang++', '-E', '-x', 'c++', '-', '-v'],
-                input='',
-                capture_output=True,
-                text=True,
-                check=True
-            )
-
-            # 解析输出，提取 include path
-            output = result.stderr
+        clang_exe = shutil.which('clang++')
+        if clang_exe is None:
+            raise RuntimeError('cannot find system include path: clang++ not found')
+        clang_exe = os.path.realpath(clang_exe)
+        paths = _discover_system_include_paths(clang_exe, os.stat(clang_exe).st_mtime)
+        self._system_include_paths = list(paths)
+        toolchain = [f'{clang_exe}:{os.stat(clang_exe).st_mtime_ns}']
+        for path in paths:
+            try:
+                toolchain.append(f'{path}:{os.stat(path).st_mtime_ns}')
+            except OSError:
+                toolchain.append(path)
+        self._toolchain = '\0'.join(toolchain)
+        return self._system_include_paths
+
+    def _parse(self, source_file: Path, type_names: List[str], args: List[str]) -> TranslationUnit:
+        """
+        解析源文件，同时将类型名称在源文件的上下文中解析为规范的类型名称，
+        保存到 `self._types` 中以便进行严格的类型匹配。
 
-            # 查找包含路径的部分
-            start_marker = '#include <...> search starts here:'
-            end_marker = 'End of search list.'
+        每个类型名称都被写成一个类型别名声明附加到源文件末尾，与源文件一起解析，
+        函数查找和类型解析共用同一个翻译单元，只需要解析一次。
 
-            start_idx = output.find(start_marker)
-            if start_idx == -1:
-                raise RuntimeError('beginning of include paths not found in clang++ output')
+        :param source_file: 要解析的源文件
+        :param type_names: 所有要解析的类型名称
+        :param args: 用于解析 `source_file` 的编译参数
+        :return: clang 翻译单元
+        """
+        source_code = [_read_file(source_file).decode('utf-8'), '\n']
+        # 同一个类型名称在不同源文件（不同提交）中可能是不同的类型，不能沿用上次解析的结果
+        self._types = {}
+
+        alias_to_type = {}  # 临时类型别名到类型名的映射
+        logger.debug('following alias declarations are append to source file:')
+        for i, type_name in enumerate(dict.fromkeys(type_names)):
+            alias_name = f'__judger_tmp_type_for_parse_{i}__'
+            # 与变量声明不同，类型别名对引用类型和 void 同样合法
+            source_code.append(f'using {alias_name} = {type_name};\n')
+            logger.debug(source_code[-1].strip())
+            alias_to_type[alias_name] = type_name
+
+        # 函数签名只需要声明，跳过函数体的解析；函数体的范围之后再从词法单元中找出
+        filename = str(source_file)
+        unsaved_files = [(filename, ''.join(source_code))]
+        options = TranslationUnit.PARSE_SKIP_FUNCTION_BODIES
+        tu = None
+        pch_path = _get_prelude_pch(self.index, args, self._toolchain)
+        if pch_path is not None:
+            try:
+                tu = self.index.parse(
+                    path=filename,
+                    args=['-include-pch', str(pch_path), *args],
+                    unsaved_files=unsaved_files,
+                    options=options
+                )
+            except TranslationUnitLoadError:
+                tu = None
+            # libclang 通常把不兼容或已经过期（如标准库被更新）的 PCH 报告为致命错误，而不是解析失败；
+            # 源文件在编译时已经通过，使用 PCH 时出现致命错误只能是 PCH 的问题
+            if tu is None or any(diag.severity >= Diagnostic.Fatal for diag in tu.diagnostics):
+                logger.warning(f'cannot parse with precompiled header {pch_path}, ignore it')
+                _discard_prelude_pch(pch_path)
+                tu = None
+        if tu is None:
+            tu = self.index.parse(
+                path=filename,
+                args=args,
+                unsaved_files=unsaved_files,
+                options=options
+            )
+        for diag in tu.diagnostics:
+            logger.warning(diag)
+        # 类型别名位于源文件末尾，从后向前查找，找齐后就不必再检查头文件中的声明
+        remaining = len(alias_to_type)
+        for cursor in reversed(list(tu.cursor.get_children())):
+            if remaining == 0:
+                break
+            if cursor.kind == CursorKind.TYPE_ALIAS_DECL and cursor.spelling in alias_to_type:
+                type_name = alias_to_type[cursor.spelling]
+                canonical_name = cursor.underlying_typedef_type.get_canonical().spelling
+                logger.debug(f'type {type_name} parsed to: {canonical_name}')
+                self._types[type_name] = canonical_name
+                remaining -= 1
+        return tu
+
+    def _get_compile_args(self, source_file_path: Path) -> List[str]:
+        """
+        获取用 libclang 解析源文件时使用的编译参数
 
-            end_idx = output.find(end_marker, start_idx)
-            if end_idx == -1:
-                raise RuntimeError('end of include paths not found in clang++ output')
+        :param source_file_path: 源文件绝对路径
+        :return: 编译参数，调用者不应修改
+        :raises RuntimeError: 当找不到源文件的编译命令时抛出
+        """
+        cached_args = self._args_cache.get(source_file_path)
+        if cached_args is not None:
+            return cached_args
 
-            # 提取路径部分
-            paths_section = output[start_idx + len(start_marker):end_idx]
+        # 查找编译命令
+        compile_command: CompileCommand = self.compile_db.getCompileCommands(
+            source_file_path
+        )[0]
 
-            # 按行分割并提取路径
-            paths = []
-            for line in paths_section.split('\n'):
-                line = line.strip()
-                if line and not line.startswith('ignoring nonexistent directory'):
-                    paths.append(line)
+        if not compile_command:
+            # 如果找不到编译命令，抛出异常报错
+            logger.error(f'compile commands of {source_file_path} not found')
+            raise RuntimeError(f'compile command not found for {source_file_path}')
 
-            self._system_include_paths = paths
-            return paths
+        # 使用编译命令解析源文件
+        # 第一个参数是编译器，最后两个参数是源文件名，不应该传递给 libclang
+        args = list(compile_command.arguments)[1:-2]
 
-        except subprocess.CalledProcessError as e:
-            logger.error(f'failed to call clang++: {e}')
-            raise RuntimeError(f'cannot find system include path: {e}') from e
-        except Exception as e:
-            logger.error(f'unexpected error occurred when finding system include path: {e}')
-            raise RuntimeError(f'unexpected error occurred when finding include path: {e}') from e
+        # 添加系统 include path
+        system_include_paths = self._get_system_include_paths()
+        for path in system_include_paths:
+            args.extend(['-isystem', path])
 
-    def _parse_types(
-            self, type_names: List[str], source_file: Path, tu: TranslationUnit, args: List[str]
-    ) -> None:
-        """
-        将类型名称在给定的翻译单元上下文中转换为 `clang.cindex.Type` 对象，
-        保存解析得到的 `Type` 到 `self._types` 中以便进行严格的类型匹配。
-
-        :param type_names: 所有要解析的类型名称
-        :param source_file: 提供上下文的源文件
-        :param tu: clang 翻译单元
-        :param args: 用于解析 `source_file` 的编译参数
-        """
-        with source_file.open('r') as f:
-            source_code = f.readlines()
-
-        var_to_type = {}  # 临时变量名到类型名的映射
-        logger.debug('following variable declarations are append to source file:')
-        for i, type_name in enumerate(type_names):
-            var_name = f'__judger_tmp_var_for_parse_{i}__'
-            source_code.append(f'[[maybe_unused]] {type_name} {var_name};\n')  # 定义一个该类型的变量
-            logger.debug(source_code[-1].strip())
-            var_to_type[var_name] = type_name
-
-        # 将上面的变量定义附加到源文件末尾得到一个临时文件，再解析这个文件得到类型
-        filename = tu.spelling
-        index = tu.index
-        temp_tu = index.parse(
-            path=filename,
-            args=args,
-            unsaved_files=[(filename, ''.join(source_code))]
-        )
-        for diag in temp_tu.diagnostics:
-            logger.warning(diag)
-        for cursor in temp_tu.cursor.walk_preorder():
-            if cursor.spelling in var_to_type:
-                type_name = var_to_type[cursor.spelling]
-                logger.debug(
-                    f'type {type_name} parsed to: {cursor.type.get_canonical().spelling}'
-                )
-                self._types[type_name] = cursor.type
+        logger.debug(f'compilation args:\n{args}')
+        self._args_cache[source_file_path] = args
+        return args
 
     def extract_function_implementation(
         self,
@@ -145,60 +417,45 @@ class FunctionExtractor:
         :return: 函数实现代码，如果未找到则返回None
         :raises RuntimeError: 当提取流程出现错误时抛出
         """
-        try:
-            # 查找编译命令
-            compile_command: CompileCommand = self.compile_db.getCompileCommands(
-                source_file_path
-            )[0]
-
-            if compile_command:
-                # 使用编译命令解析源文件
-                # 第一个参数是编译器，最后两个参数是源文件名，不应该传递给 libclang
-                args = list(compile_command.arguments)[1:-2]
-
-                # 添加系统 include path
-                system_include_paths = self._get_system_include_paths()
-                for path in system_include_paths:
-                    args.extend(['-isystem', path])
-
-                logger.debug(f'compilation args:\n{args}')
-                tu = self.index.parse(str(source_file_path), args=args)
-                logger.info(f'successfully parsed {source_file_path} to a translation unit')
-                type_names = [function_signature.return_type]
-                for param in function_signature.parameters:
-                    type_names.append(param.type)
-                logger.info(f'try to parse {len(type_names)} types')
-                self._parse_types(type_names, source_file_path, tu, args)
-                logger.info('successfully parsed all types in function signature')
-            else:
-                # 如果找不到编译命令，抛出异常报错
-                logger.error(f'compile commands of {source_file_path} not found')
-                raise RuntimeError(f'compile command not found for {source_file_path}')
-
-            logger.info(f'try to match the signature of {function_signature.name}')
-            # 查找匹配的函数定义
-            function_cursor = self._find_function_signature(tu.cursor, function_signature)
+        return self.extract_many(source_file_path, [function_signature])[0]
 
-            if function_cursor is None:
-                logger.warning(
-                    f'signature of {function_signature.name} does not match any source code'
-                )
-                return None
-            else:
-                logger.info('signature found')
+    def extract_many(
+        self,
+        source_file_path: Path,
+        function_signatures: List[FunctionSignature]
+    ) -> List[Optional[str]]:
+        """
+        从同一个源文件中提取多个函数的实现，源文件只解析一次，AST 也只遍历一次
 
-            # 提取函数实现
-            implementation = self._extract_function_body(function_cursor)
+        :param source_file_path: 源文件绝对路径
+        :param function_signatures: 函数签名列表
+        :return: 与函数签名一一对应的函数实现，未找到的函数对应 None
+        :raises RuntimeError: 当提取流程出现错误时抛出
+        """
+        try:
+            args = self._get_compile_args(source_file_path)
 
-            if implementation:
-                logger.info(f'successfully extracted implementation of {function_signature.name}')
-            else:
-                # 跳过函数声明之后，第二处签名匹配的位置仍然没有函数体
-                logger.warning(
-                    f'only declaration of {function_signature.name} found, no definition'
-                )
+            # 先查找缓存，只有缓存未命中的函数才需要解析源文件
+            implementations, pending = self._lookup_cache(source_file_path, function_signatures)
+            if not pending:
+                return implementations
 
-            return implementation
+            type_names = []
+            for i, _ in pending:
+                type_names.append(function_signatures[i].return_type)
+                for param in function_signatures[i].parameters:
+                    type_names.append(param.type)
+            logger.info(f'try to parse {source_file_path} with {len(type_names)} types')
+            tu = self._parse(source_file_path, type_names, args)
+            logger.info(f'successfully parsed {source_file_path} to a translation unit')
+
+            function_index = self._index_functions(tu.cursor)
+            dependencies = self._project_dependencies(tu)
+            for i, cache_key in pending:
+                implementation = self._extract_from_index(function_index, function_signatures[i])
+                _cache_implementation(cache_key, dependencies, implementation)
+                implementations[i] = implementation
+            return implementations
 
         except RuntimeError:
             # 重新抛出 RuntimeError
@@ -206,51 +463,251 @@ class FunctionExtractor:
         except Exception as e:
             # 其他异常转换为 RuntimeError 并抛出
             logger.error(
-                f'unexpected error when extracting {function_signature.name}: {type(e)}: {str(e)}'
+                f'unexpected error when extracting functions from {source_file_path}: '
+                f'{type(e)}: {str(e)}'
             )
             raise RuntimeError('failed to extract function implementation')
 
+    def _cache_keys(
+        self,
+        source_file_path: Path,
+        function_signatures: List[FunctionSignature]
+    ) -> List[Tuple]:
+        """
+        计算各函数提取结果的缓存键
+
+        :param source_file_path: 源文件绝对路径
+        :param function_signatures: 函数签名列表
+        :return: 与函数签名一一对应的缓存键
+        """
+        project_dir = self.build_dir.parent
+        project_root = str(project_dir)
+        args = tuple(
+            arg.replace(project_root, _PROJECT_DIR_PLACEHOLDER)
+            for arg in self._get_compile_args(source_file_path)
+        )
+        if source_file_path.is_relative_to(project_dir):
+            relative_path = str(source_file_path.relative_to(project_dir))
+        else:
+            relative_path = str(source_file_path)
+        source_digest = _file_digest(source_file_path)
+        return [
+            (relative_path, source_digest, args, signature) for signature in function_signatures
+        ]
+
+    def _lookup_cache(
+        self,
+        source_file_path: Path,
+        function_signatures: List[FunctionSignature]
+    ) -> Tuple[List[Optional[str]], List[Tuple[int, Tuple]]]:
+        """
+        在缓存中查找函数的提取结果
+
+        :param source_file_path: 源文件绝对路径
+        :param function_signatures: 函数签名列表
+        :return: (与函数签名一一对应的函数实现, 缓存未命中的函数的 (下标, 缓存键) 列表)
+        """
+        implementations: List[Optional[str]] = [None] * len(function_signatures)
+        pending = []
+        cache_keys = self._cache_keys(source_file_path, function_signatures)
+        for i, (function_signature, cache_key) in enumerate(zip(function_signatures, cache_keys)):
+            cache_entry = _get_cached_implementation(cache_key, self.build_dir.parent)
+            if cache_entry is None:
+                pending.append((i, cache_key))
+            else:
+                logger.info(f'reuse cached extraction result of {function_signature.name}')
+                implementations[i] = cache_entry[1]
+        return implementations, pending
+
+    def _extract_from_index(
+        self,
+        function_index: Dict[Tuple[str, int], List[Cursor]],
+        function_signature: FunctionSignature
+    ) -> Optional[str]:
+        """
+        在函数索引中查找签名匹配的函数并提取其实现
+
+        :param function_index: `_index_functions` 建立的函数索引
+        :param function_signature: 函数签名
+        :return: 函数实现代码，如果未找到则返回None
+        :raises RuntimeError: 当提取流程出现错误时抛出
+        """
+        logger.info(f'try to match the signature of {function_signature.name}')
+        # 查找匹配的函数定义
+        function_cursor = self._find_function_signature(function_index, function_signature)
+
+        if function_cursor is None:
+            logger.warning(
+                f'signature of {function_signature.name} does not match any source code'
+            )
+            return None
+        else:
+            logger.info('signature found')
+
+        # 提取函数实现
+        implementation = self._extract_function_body(function_cursor)
+
+        if implementation:
+            logger.info(f'successfully extracted implementation of {function_signature.name}')
+        else:
+            # 跳过函数声明之后，第二处签名匹配的位置仍然没有函数体
+            logger.warning(
+                f'only declaration of {function_signature.name} found, no definition'
+            )
+
+        return implementation
+
+    def _project_dependencies(self, tu: TranslationUnit) -> Tuple[Tuple[Path, str], ...]:
+        """
+        获取翻译单元用到的所有项目文件（不包括系统头文件）及其 SHA-256 摘要
+
+        :param tu: clang 翻译单元
+        :return: 项目文件相对项目目录的路径和摘要组成的元组
+        """
+        project_dir = self.build_dir.parent
+        files = {Path(tu.spelling)}
+        for inclusion in tu.get_includes():
+            files.add(Path(inclusion.include.name))
+        dependencies = []
+        for file in files:
+            if not file.is_absolute():
+                file = project_dir / file
+            if file.is_relative_to(project_dir):
+                dependencies.append((file.relative_to(project_dir), _file_digest(file)))
+        return tuple(dependencies)
+
+    @staticmethod
+    def _index_functions(root_cursor: Cursor) -> Dict[Tuple[str, int], List[Cursor]]:
+        """
+        遍历一次 AST，按函数名（不含类名）和参数个数索引源文件中所有的函数和方法，
+        提取多个函数时只需要在各自的候选列表中比较签名
+
+        :param root_cursor: AST根节点
+        :return: 函数索引 {(函数名, 参数个数): [按出现顺序排列的函数游标]}
+        """
+        function_index: Dict[Tuple[str, int], List[Cursor]] = {}
+        source_file = root_cursor.spelling
+        tu = root_cursor.translation_unit
+
+        def visitor(cursor: Cursor, parent: Cursor, data: Any) -> int:
+            # 只访问源文件中的声明，也只进入可能包含函数声明的节点，
+            # 不遍历头文件（如标准库）和函数参数等节点
+            location_file = cursor.location.file
+            if location_file is None or location_file.name != source_file:
+                return _CHILD_VISIT_CONTINUE
+            # 与 `Cursor.get_children` 相同，保存对翻译单元的引用，翻译单元不会先于游标被回收
+            cursor._tu = tu
+            kind = cursor.kind
+            if kind in _SCOPE_KINDS:
+                return _CHILD_VISIT_RECURSE
+            if kind == CursorKind.FUNCTION_DECL or kind == CursorKind.CXX_METHOD:
+                key = (cursor.spelling, len(list(cursor.get_arguments())))
+                function_index.setdefault(key, []).append(cursor)
+            return _CHILD_VISIT_CONTINUE
+
+        # 由 libclang 按先序递归遍历 AST，不必为每一层节点构造子节点列表
+        conf.lib.clang_visitChildren(root_cursor, callbacks['cursor_visit'](visitor), None)
+        return function_index
+
     def _find_function_signature(
         self,
-        root_cursor: Cursor,
+        function_index: Dict[Tuple[str, int], List[Cursor]],
         function_signature: FunctionSignature
     ) -> Optional[Cursor]:
         """
-        在AST中查找匹配的函数签名。因为第一个匹配结果必定是函数的声明，所以该函数会忽略它，
+        在函数索引中查找匹配的函数签名。因为第一个匹配结果必定是函数的声明，所以该函数会忽略它，
         返回第二个匹配成功的游标。
 
-        :param root_cursor: AST根节点
+        :param function_index: `_index_functions` 建立的函数索引
         :param function_signature: 函数签名
         :return: 匹配成功的函数游标，如果未找到则返回 None
         """
-        # 遍历AST查找函数定义
-        for cursor in root_cursor.walk_preorder():
-            if cursor.kind == CursorKind.FUNCTION_DECL or cursor.kind == CursorKind.CXX_METHOD:
-                if self._is_function_match(cursor, function_signature):
-                    # 如果一个翻译单元包含了这个函数的定义 (definition)，
-                    # 那么其中一定先出现声明 (declaration) 才出现定义，所以需要跳过声明
-                    body_cursor = None
-                    for child in cursor.get_children():
-                        if child.kind == CursorKind.COMPOUND_STMT:
-                            body_cursor = child
-                            break
-                    if body_cursor is None:
-                        # 这个函数没有函数体，只是一个声明而不是定义
-                        continue
-                    return cursor
+        name = function_signature.name.split('::')[-1]
+        candidates = function_index.get((name, len(function_signature.parameters)), [])
+        if not candidates:
+            return None
+
+        # 签名的类型只需要组合一次，与每个候选函数的类型比较时只需比较一次元组
+        type_names = [function_signature.return_type]
+        type_names.extend(param.type for param in function_signature.parameters)
+        unresolved = [type_name for type_name in type_names if type_name not in self._types]
+        if unresolved:
+            # 类型在源文件中无法解析，源文件中不可能有与签名匹配的函数
+            logger.warning(f'types {unresolved} cannot be resolved in {name}\'s source file')
+            return None
+        signature_type_key = (
+            self._types[function_signature.return_type],
+            tuple(self._types[param.type] for param in function_signature.parameters)
+        )
+        for cursor in candidates:
+            if self._is_function_match(cursor, function_signature, signature_type_key):
+                # 如果一个翻译单元包含了这个函数的定义 (definition)，
+                # 那么其中一定先出现声明 (declaration) 才出现定义，所以需要跳过声明
+                if self._find_body_end(cursor) is None:
+                    # 这个函数没有函数体，只是一个声明而不是定义
+                    continue
+                return cursor
+
+        return None
+
+    @staticmethod
+    def _find_body_end(function_cursor: Cursor) -> Optional[SourceLocation]:
+        """
+        查找函数体的结束位置。
+
+        解析时跳过了函数体，函数游标没有函数体子节点，其范围也只到声明的末尾为止，
+        所以从声明之后的词法单元中找出函数体：声明之后（跳过括号内的内容，如 `noexcept(...)`）
+        第一个 `{` 开始函数体，与它配对的 `}` 结束函数体；如果先遇到 `;` 或 `=`，则没有函数体。
 
+        :param function_cursor: 函数游标
+        :return: 函数体结束位置，函数没有函数体时返回 None
+        """
+        declaration_end = function_cursor.extent.end
+        file = declaration_end.file
+        if file is None:
+            return None
+        tu = function_cursor.translation_unit
+        file_end = SourceLocation.from_offset(tu, file, os.path.getsize(file.name))
+        tokens = tu.get_tokens(extent=SourceRange.from_locations(declaration_end, file_end))
+
+        paren_depth = 0
+        brace_depth = 0
+        for token in tokens:
+            if token.extent.start.offset < declaration_end.offset:
+                # 与声明末尾重叠的词法单元属于声明本身
+                continue
+            spelling = token.spelling
+            if brace_depth > 0:
+                if spelling == '{':
+                    brace_depth += 1
+                elif spelling == '}':
+                    brace_depth -= 1
+                    if brace_depth == 0:
+                        return token.extent.end
+            elif spelling == '(':
+                paren_depth += 1
+            elif spelling == ')':
+                paren_depth -= 1
+            elif paren_depth == 0:
+                if spelling == '{':
+                    brace_depth = 1
+                elif spelling in (';', '=', '}'):
+                    return None
         return None
 
     def _is_function_match(
         self,
         function_cursor: Cursor,
-        function_signature: FunctionSignature
+        function_signature: FunctionSignature,
+        signature_type_key: Tuple[str, Tuple[str, ...]]
     ) -> bool:
         """
         检查函数是否与给定的函数签名匹配
 
         :param function_cursor: 函数定义节点
         :param function_signature: 函数签名
+        :param signature_type_key: 签名中返回类型和各参数类型的规范名称，
+            格式为 `(返回类型, (参数类型, ...))`
         :return: 是否匹配
         :raises ValueError: 当函数名称包含多个 :: 时抛出
         """
@@ -294,28 +751,14 @@ class FunctionExtractor:
                 return False
         logger.debug(f'function name matched: {name}')
 
-        # 检查返回类型
-        cursor_result_type_name = function_cursor.result_type.get_canonical().spelling
-        signature_return_type = self._types[function_signature.return_type]
-        signature_return_type_name = signature_return_type.get_canonical().spelling
-        if cursor_result_type_name != signature_return_type_name:
-            return False
-        logger.debug(f'result type matched: {signature_return_type_name}')
-
-        # 检查参数列表
-        cursor_params = list(function_cursor.get_arguments())
-        signature_params = function_signature.parameters
-
-        if len(cursor_params) != len(signature_params):
+        # 检查返回类型和参数列表
+        cursor_type_key = (
+            function_cursor.result_type.get_canonical().spelling,
+            tuple(param.type.get_canonical().spelling for param in function_cursor.get_arguments())
+        )
+        if cursor_type_key != signature_type_key:
             return False
-
-        for cursor_param, signature_param in zip(cursor_params, signature_params):
-            cursor_param_type_name = cursor_param.type.get_canonical().spelling
-            signature_param_type = self._types[signature_param.type]
-            signature_param_type_name = signature_param_type.get_canonical().spelling
-            if cursor_param_type_name != signature_param_type_name:
-                return False
-            logger.debug(f'param type matched: {signature_param_type_name}')
+        logger.debug(f'result and param types matched: {signature_type_key}')
 
         return True
 
@@ -329,17 +772,13 @@ class FunctionExtractor:
         """
         try:
             # 获取函数体的范围
-            body_cursor = None
-            for child in function_cursor.get_children():
-                if child.kind == CursorKind.COMPOUND_STMT:
-                    body_cursor = child
-                    break
+            body_end = self._find_body_end(function_cursor)
 
-            if body_cursor is None:
+            if body_end is None:
                 logger.warning('the function cursor does not have a function body')
                 return None
 
-            # 获取源文件内容
+            # 获取源文件路径
             source_file = Path(function_cursor.location.file.name)
             if not source_file.is_absolute():
                 source_file = self.build_dir.parent / source_file
@@ -347,31 +786,11 @@ class FunctionExtractor:
             if not source_file.exists():
                 raise RuntimeError(f'source file {source_file} not found')
 
-            with open(source_file, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-
-            # 获取函数体的起始和结束位置
-            start_location = function_cursor.extent.start
-            end_location = body_cursor.extent.end
-
-            # 将从 1 开始的行号和列号转换成从 0 开始的下标，
-            # 起始行/列、终止行/列所在的字符都包括在内
-            start_line = start_location.line - 1
-            start_column = start_location.column - 1
-            end_line = end_location.line - 1
-            end_column = end_location.column
-
-            # 提取函数体
-            if start_line == end_line:
-                # 单行函数体
-                function_body = lines[start_line][start_column:end_column]
-            else:
-                # 多行函数体
-                function_body = [lines[start_line][start_column:] + '\n']
-                for i in range(start_line + 1, end_line):
-                    function_body.append(lines[i])
-                function_body.append(lines[end_line][:end_column])
-                function_body = ''.join(function_body)
+            # 函数的起始位置和函数体的结束位置都是字节偏移量，结束位置不包括在内，
+            # 源文件在解析时已经读入缓存，只需要截取这一段字节
+            start_offset = function_cursor.extent.start.offset
+            end_offset = body_end.offset
+            function_body = _read_file(source_file)[start_offset:end_offset].decode('utf-8')
 
             return function_body
 
@@ -393,5 +812,147 @@ def extract_function_implementation(
     :param build_dir: 构建目录绝对路径，用于查找 compile_commands.json
     :return: 函数实现代码，如果未找到则返回None
     """
-    extractor = FunctionExtractor(build_dir)
+    extractor = _get_extractor(build_dir)
     return extractor.extract_function_implementation(source_file_path, function_signature)
+
+
+def extract_function_implementations(
+    source_file_path: Path,
+    function_signatures: List[FunctionSignature],
+    build_dir: Path
+) -> List[Optional[str]]:
+    """
+    从同一个源文件中提取多个函数的实现，源文件只解析一次
+
+    :param source_file_path: 源文件绝对路径
+    :param function_signatures: 函数签名列表
+    :param build_dir: 构建目录绝对路径，用于查找 compile_commands.json
+    :return: 与函数签名一一对应的函数实现，未找到的函数对应 None
+    """
+    extractor = _get_extractor(build_dir)
+    return extractor.extract_many(source_file_path, function_signatures)
+
+
+def _get_extractor(build_dir: Path) -> FunctionExtractor:
+    """
+    获取构建目录对应的函数提取器，同一次评测中提取多个函数时共用同一个提取器，
+    不必为每个函数重新读取 compile_commands.json
+
+    :param build_dir: 构建目录绝对路径
+    :return: 函数提取器
+    """
+    # 评测目录的路径可能在重新评测时被复用，所以同时用 compile_commands.json 的修改时间区分
+    mtime_ns = (build_dir / 'compile_commands.json').stat().st_mtime_ns
+    return _get_cached_extractor(build_dir, mtime_ns)
+
+
+@functools.lru_cache(maxsize=4)
+def _get_cached_extractor(build_dir: Path, mtime_ns: int) -> FunctionExtractor:
+    """按构建目录和 compile_commands.json 的修改时间缓存函数提取器"""
+    return FunctionExtractor(build_dir)
+
+
+# 并行提取函数的进程池，在当前进程中第一次需要时创建，之后的评测都复用它，
+# 工作进程中的 libclang 索引、PCH 和提取器等缓存在多次评测之间保持有效
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_owner_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """获取当前进程的函数提取进程池，不存在时创建它"""
+    global _pool, _pool_owner_pid
+    with _pool_lock:
+        if _pool is None or _pool_owner_pid != os.getpid():
+            # 工作进程按需创建，最多与 CPU 核数相同；它们由预先导入了本模块的 forkserver 进程创建，
+            # 无需重新导入本模块
+            _pool = ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1, mp_context=get_mp_context()
+            )
+            _pool_owner_pid = os.getpid()
+            atexit.register(shutdown_pool)
+        return _pool
+
+
+def shutdown_pool() -> None:
+    """关闭并回收当前进程创建的函数提取进程池"""
+    global _pool, _pool_owner_pid
+    with _pool_lock:
+        if _pool is None or _pool_owner_pid != os.getpid():
+            return
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+        _pool_owner_pid = None
+
+
+def _extract_in_worker(
+    source_file_path: Path,
+    function_signatures: List[FunctionSignature],
+    build_dir: Path
+) -> Tuple[List[Optional[str]], List[Tuple[Tuple, Tuple]]]:
+    """
+    在进程池的工作进程中提取函数实现，同时返回对应的缓存条目，由调用者合并到自己的缓存中
+
+    :param source_file_path: 源文件绝对路径
+    :param function_signatures: 函数签名列表
+    :param build_dir: 构建目录绝对路径，用于查找 compile_commands.json
+    :return: (与函数签名一一对应的函数实现, [(缓存键, 缓存条目)])
+    """
+    extractor = _get_extractor(build_dir)
+    implementations = extractor.extract_many(source_file_path, function_signatures)
+    entries = []
+    for cache_key in extractor._cache_keys(source_file_path, function_signatures):
+        cache_entry = _implementation_cache.get(cache_key)
+        if cache_entry is not None:
+            entries.append((cache_key, cache_entry))
+    return implementations, entries
+
+
+def extract_many_parallel(
+    jobs: List[Tuple[Path, List[FunctionSignature]]],
+    build_dir: Path
+) -> List[List[Optional[str]]]:
+    """
+    并行地从多个源文件中提取函数的实现，每个源文件由一个进程解析一次。
+    libclang 解析源文件时不会释放 GIL，所以使用多进程而不是多线程。
+
+    工作进程的提取结果会合并到当前进程的缓存中，重新评测相同的代码时直接使用缓存，不必再交给工作进程。
+
+    :param jobs: 要提取的函数，每一项为 (源文件绝对路径, 该源文件中的函数签名列表)
+    :param build_dir: 构建目录绝对路径，用于查找 compile_commands.json
+    :return: 与 `jobs` 一一对应的提取结果，每一项是与函数签名一一对应的函数实现，未找到的函数对应 None
+    :raises RuntimeError: 当提取流程出现错误时抛出
+    """
+    extractor = _get_extractor(build_dir)
+    results: List[Optional[List[Optional[str]]]] = [None] * len(jobs)
+    pending = []  # 当前进程的缓存无法满足的源文件在 `jobs` 中的下标
+    for i, (source_file_path, signatures) in enumerate(jobs):
+        implementations, missing = extractor._lookup_cache(source_file_path, signatures)
+        if missing:
+            pending.append(i)
+        else:
+            results[i] = implementations
+
+    if len(pending) <= 1:
+        # 只有一个源文件需要解析时不值得把任务交给其他进程
+        for i in pending:
+            results[i] = extractor.extract_many(*jobs[i])
+        return results
+
+    pool = _get_pool()
+    try:
+        futures = [
+            (i, pool.submit(_extract_in_worker, jobs[i][0], jobs[i][1], build_dir))
+            for i in pending
+        ]
+        for i, future in futures:
+            implementations, entries = future.result()
+            for cache_key, (dependencies, implementation) in entries:
+                _cache_implementation(cache_key, dependencies, implementation)
+            results[i] = implementations
+    except BrokenProcessPool as e:
+        # 工作进程异常退出（如 libclang 崩溃），丢弃这个进程池，下次提取时重新创建
+        logger.error(f'function extraction worker died: {e}')
+        shutdown_pool()
+        raise RuntimeError('failed to extract function implementation') from e
+    return results
@@ -4,26 +4,26 @@
 该模块定义了函数提取功能所需的数据结构。
 """
 
-from typing import List, Dict, Any
+from typing import Tuple, Dict, Any
 from dataclasses import dataclass
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class FunctionParameter:
     """函数参数"""
     name: str
     type: str
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class FunctionSignature:
     """函数签名"""
     return_type: str
     name: str
-    parameters: List[FunctionParameter]
+    parameters: Tuple[FunctionParameter, ...]
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class FunctionRequirement:
     """函数需求"""
     id: int
@@ -63,7 +63,7 @@ def parse_function_signature(signature_data: Dict[str, Any]) -> FunctionSignatur
 
         parameters.append(FunctionParameter(param_name, param_type))
 
-    return FunctionSignature(return_type, name, parameters)
+    return FunctionSignature(return_type, name, tuple(parameters))
 
 
 def parse_function_requirement(requirement_data: Dict[str, Any]) -> FunctionRequirement:
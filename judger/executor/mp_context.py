@@ -0,0 +1,30 @@
+"""
+多进程上下文
+
+执行节点中所有的工作进程（验证进程、函数提取进程）都由同一个 forkserver 上下文创建。
+forkserver 预先导入的模块列表是进程全局的设置，只在这里设置一次，
+各模块不必在导入时各自设置而相互覆盖。
+"""
+
+import functools
+import multiprocessing
+from multiprocessing.context import BaseContext
+
+
+# forkserver 进程预先导入的模块，由它创建的工作进程无需重新导入这些模块
+_FORKSERVER_PRELOAD = [
+    'judger.executor.validate',
+    'judger.executor.function_extractor',
+]
+
+
+@functools.lru_cache(maxsize=None)
+def get_mp_context() -> BaseContext:
+    """
+    获取执行节点共用的 forkserver 上下文，第一次调用时设置 forkserver 预先导入的模块
+
+    :return: forkserver 上下文
+    """
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(_FORKSERVER_PRELOAD)
+    return context
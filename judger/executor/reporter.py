@@ -1,10 +1,10 @@
 import time
-import subprocess
+import signal
 import socket
-import requests
 import logging
 from typing import Dict, Any
 from judger.executor.config import Config
+from judger.utils.http_session import create_session
 
 logger = logging.getLogger('reporter')
 logging.basicConfig(
@@ -12,51 +12,71 @@ logging.basicConfig(
     format='[%(levelname)s][%(name)s][%(asctime)s] %(message)s'
 )
 
+# 上报脚本定期访问本地服务和管理节点，复用同一个会话中的连接
+_session = create_session(pool_maxsize=2)
+
 
 class StatusReporter:
     def __init__(self):
         self.manager_url = f'http://{Config.MANAGER_IP}:{Config.MANAGER_PORT}/api/judge/executors'
+        # CPU 和内存信息在运行期间不会变化，启动时读取一次即可
+        self._cpu_info = self._read_cpu_info()
+        self._memory_mib = self._read_memory_info()
 
-    def get_cpu_info(self) -> Dict[str, str]:
-        """获取CPU信息"""
+    @staticmethod
+    def _read_cpu_info() -> Dict[str, str]:
+        """从 /proc/cpuinfo 读取CPU信息"""
         try:
-            result = subprocess.run(
-                ['lscpu', '-p=cpu,modelname'],
-                capture_output=True, text=True, check=True
-            )
-            output = result.stdout
-
-            # Format example: 19,Intel Core i5 xxxx
-            last_line = output.splitlines()[-1].split(',')
-
+            model_name = 'unknown'
+            n_cpus = 0
+            with open('/proc/cpuinfo') as f:
+                for line in f:
+                    key, _, value = line.partition(':')
+                    key = key.strip()
+                    if key == 'processor':
+                        n_cpus += 1
+                    elif key == 'model name' and model_name == 'unknown':
+                        model_name = value.strip()
             return {
-                'cpu_model_name': last_line[1],
-                'n_cpus': int(last_line[0]) + 1
+                'cpu_model_name': model_name,
+                'n_cpus': n_cpus
             }
         except Exception as e:
-            logger.error(f'Failed to get CPU info: {e}')
+            logger.error('Failed to get CPU info: %s', e)
             return {
                 'cpu_model_name': 'unknown',
                 'n_cpus': 0
             }
 
-    def get_memory_info(self) -> int:
-        """获取内存信息（单位：MiB）"""
+    @staticmethod
+    def _read_memory_info() -> int:
+        """从 /proc/meminfo 读取内存信息（单位：MiB）"""
         try:
-            result = subprocess.run(['free', '-m'], capture_output=True, text=True, check=True)
-            output = result.stdout.splitlines()[1]
-            return int(output.split()[1])
+            with open('/proc/meminfo') as f:
+                for line in f:
+                    if line.startswith('MemTotal:'):
+                        # 格式示例：MemTotal:       16318436 kB
+                        return int(line.split()[1]) // 1024
+            raise RuntimeError('MemTotal not found in /proc/meminfo')
         except Exception as e:
-            logger.error(f'Failed to get memory info: {e}')
+            logger.error('Failed to get memory info: %s', e)
             return 0
 
+    def get_cpu_info(self) -> Dict[str, str]:
+        """获取CPU信息"""
+        return self._cpu_info
+
+    def get_memory_info(self) -> int:
+        """获取内存信息（单位：MiB）"""
+        return self._memory_mib
+
     def check_service_alive(self) -> bool:
         """检查本地Flask服务是否存活"""
         try:
-            response = requests.get('http://127.0.0.1:10011/alive', timeout=5)
+            response = _session.get('http://127.0.0.1:10011/alive', timeout=5)
             return response.status_code == 200
         except Exception as e:
-            logger.error(f'Service alive check failed: {e}')
+            logger.error('Service alive check failed: %s', e)
             return False
 
     def collect_status(self) -> Dict[str, Any]:
@@ -74,22 +94,31 @@ class StatusReporter:
         """上报状态到管理节点"""
         status = self.collect_status()
         try:
-            response = requests.post(
+            response = _session.post(
                 self.manager_url,
                 json=status,
-                timeout=10
+                timeout=(3, 10)
             )
             response.raise_for_status()
-            logger.info(f'Status reported successfully: {status}')
+            logger.info('Status reported successfully: %s', status)
         except Exception as e:
-            logger.error(f'Failed to report status: {e}')
+            logger.error('Failed to report status: %s', e)
 
     def start(self):
-        """启动定时上报"""
+        """启动定时上报，收到 SIGUSR1 信号时会立即上报一次"""
         logger.info('Starting status reporter')
+        interval = Config.KEEP_ALIVE_INTERVAL * 60
+        # 阻塞 SIGUSR1 后用 sigtimedwait 同步地等待它，不需要异步的信号处理函数
+        signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGUSR1})
+        deadline = time.monotonic()
         while True:
             self.report()
-            time.sleep(Config.KEEP_ALIVE_INTERVAL * 60)
+            # 按固定的截止时间而不是固定的间隔等待，上报本身的耗时不会让上报时间逐渐推迟
+            deadline = max(deadline + interval, time.monotonic())
+            timeout = deadline - time.monotonic()
+            if signal.sigtimedwait([signal.SIGUSR1], max(timeout, 0)) is not None:
+                logger.info('Immediate report requested')
+                deadline = time.monotonic()
 
 
 if __name__ == '__main__':
@@ -1,20 +1,29 @@
+import functools
+import os
 import shutil
 import subprocess
 import requests
 import logging
 import argparse
 import json
+import signal
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.queues import Queue
 from pathlib import Path
-from typing import Optional, List
+from typing import Optional, List, Dict, Any
 from judger.executor.config import Config
-from judger.executor.function_extractor import extract_function_implementation
-from judger.executor.function_types import (
-    FunctionRequirement, FunctionSignature, FunctionParameter
-)
+from judger.executor.function_extractor import extract_many_parallel, shutdown_pool
+from judger.executor.function_types import parse_function_requirement
+from judger.utils.dir_reaper import DirectoryReaper
+from judger.utils.http_session import create_session
 
 
 logger = logging.getLogger('validate')
 
+# 常驻的验证进程会多次提交评测结果，复用同一个会话中到管理节点的连接
+_session = create_session(pool_maxsize=2)
+
 
 def submit_result(
     judgment_id: int, result: str, log: str,
@@ -35,61 +44,160 @@ def submit_result(
     payload = {'result': result, 'log': log}
     if result == 'passed' and function_impls is not None:
         payload['function_impls'] = function_impls
-    logger.info(f'result to submit: {result}')
+    logger.info('result to submit: %s', result)
 
     try:
-        response = requests.post(url, json=payload)
+        response = _session.post(url, json=payload, timeout=(3, 10))
         if response.status_code == 200:
-            logger.info(f'result of judgment {judgment_id} submitted')
+            logger.info('result of judgment %s submitted', judgment_id)
         else:
-            logger.error(f'failed to submit judgment result: {response.status_code}')
+            logger.error('failed to submit judgment result: %s', response.status_code)
     except requests.exceptions.RequestException as e:
-        logger.error(f'cannot connect to the manager node: {type(e)}: {str(e)}')
+        logger.error('cannot connect to the manager node: %s: %s', type(e), e)
+
+
+# 评测结束后在后台删除项目目录，验证进程不必等待删除完成就可以开始下一个评测任务
+_reaper = DirectoryReaper()
+
+# 启动时解析一次 cmake 的绝对路径，不必每次启动进程时都搜索 PATH
+_CMAKE = shutil.which('cmake') or 'cmake'
+
+# 安装了 ccache 时用它作为编译器启动器，各次评测之间共享未被修改的翻译单元的编译结果
+_CCACHE = shutil.which('ccache')
+
+
+@functools.lru_cache(maxsize=None)
+def _ccache_enabled() -> bool:
+    """
+    检查是否使用 ccache：需要安装了 ccache，且缓存目录可以创建和写入
+
+    :return: 是否使用 ccache
+    """
+    if _CCACHE is None:
+        return False
+    try:
+        os.makedirs(Config.CCACHE_DIR, exist_ok=True)
+    except OSError as e:
+        logger.warning(
+            'cannot create ccache directory %s, ccache disabled: %s', Config.CCACHE_DIR, e
+        )
+        return False
+    if not os.access(Config.CCACHE_DIR, os.W_OK | os.X_OK):
+        logger.warning('ccache directory %s is not writable, ccache disabled', Config.CCACHE_DIR)
+        return False
+    return True
+
+
+def _cmake_env(template_dir: Path) -> Optional[Dict[str, str]]:
+    """
+    执行 cmake 时使用的环境变量，不使用 ccache 时返回 None（继承当前进程的环境变量）
+
+    每次评测的项目目录都不同，以项目目录作为 CCACHE_BASEDIR 让 ccache 使用相对路径计算缓存键，
+    这样不同评测中内容相同的翻译单元可以命中同一份缓存。
+
+    :param template_dir: 项目目录
+    :return: 环境变量
+    """
+    if not _ccache_enabled():
+        return None
+    env = dict(os.environ)
+    env['CCACHE_DIR'] = Config.CCACHE_DIR
+    env['CCACHE_BASEDIR'] = str(template_dir)
+    env['CCACHE_NOHASHDIR'] = '1'
+    return env
+
+
+def _launcher_args() -> List[str]:
+    """配置 CMake 项目时指定编译器启动器的参数"""
+    if not _ccache_enabled():
+        return []
+    return [f'-DCMAKE_C_COMPILER_LAUNCHER={_CCACHE}', f'-DCMAKE_CXX_COMPILER_LAUNCHER={_CCACHE}']
+
+
+def _needs_configure(build_dir: Path, source_dir: Path) -> bool:
+    """
+    判断是否需要执行 CMake 配置：构建目录中已经有同一个源代码目录的 CMakeCache.txt 时不需要。
+    之后执行 `cmake --build` 时，CMake 会在 CMakeLists.txt 被修改过的情况下自动重新配置。
+
+    :param build_dir: 构建目录
+    :param source_dir: 源代码目录
+    :return: 是否需要执行 CMake 配置
+    """
+    cache = build_dir / 'CMakeCache.txt'
+    if not cache.exists():
+        return True
+    for line in cache.read_text(errors='replace').splitlines():
+        if line.startswith('CMAKE_HOME_DIRECTORY:INTERNAL='):
+            return Path(line.split('=', 1)[1]).resolve() != source_dir.resolve()
+    return True
+
+
+def _run_logged(
+    args: List[str], log_path: Path, env: Optional[Dict[str, str]] = None
+) -> tuple[bool, str]:
+    """
+    执行命令并将输出写入日志文件，只有命令失败时才读取日志内容
+
+    :param args: 要执行的命令
+    :param log_path: 保存命令输出的日志文件
+    :param env: 命令的环境变量，为 None 时继承当前进程的环境变量
+    :return: 命令是否成功执行，以及失败时命令的输出
+    """
+    # Python 创建的文件描述符默认不会被子进程继承，不需要 close_fds，
+    # 这样 subprocess 可以使用 posix_spawn 而不是 fork + exec 启动进程
+    with log_path.open('wb') as log_file:
+        returncode = subprocess.call(
+            args, stdout=log_file, stderr=subprocess.STDOUT, env=env, close_fds=False
+        )
+    if returncode != 0:
+        return False, log_path.read_text(errors='replace')
+    return True, ''
 
 
 def compile_project(template_dir: Path, n_proc: int) -> tuple[bool, str]:
     """编译Dandelion项目"""
     build_dir = template_dir / 'build'
+    env = _cmake_env(template_dir)
 
     # 1. 创建build目录
     build_dir.mkdir(parents=True, exist_ok=True)
     logger.info('directory build/ re-created')
 
     # 2. 执行cmake配置
-    cmake_process = subprocess.run(
-        ['cmake', '-S', str(template_dir), '-B', str(build_dir)],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        check=False,
-        text=True
-    )
-    if cmake_process.returncode != 0:
-        logger.warning('failed to configure CMake project')
-        return False, cmake_process.stdout
-    logger.info('CMake project configured')
+    if _needs_configure(build_dir, template_dir):
+        success, log = _run_logged(
+            [_CMAKE, '-S', str(template_dir), '-B', str(build_dir), *_launcher_args()],
+            build_dir / 'configure.log',
+            env
+        )
+        if not success:
+            logger.warning('failed to configure CMake project')
+            return False, log
+        logger.info('CMake project configured')
+    else:
+        logger.info('CMake project already configured')
 
     # 3. 执行编译
-    build_process = subprocess.run(
-        ['cmake', '--build', str(build_dir),
+    success, log = _run_logged(
+        [_CMAKE, '--build', str(build_dir),
          '--config', 'Release',
          '--target', 'dandelion',
          '--parallel', str(n_proc)],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        check=False,
-        text=True
+        build_dir / 'build.log',
+        env
     )
-    if build_process.returncode != 0:
+    if not success:
         logger.warning('failed to compile the project')
-        return False, build_process.stdout
+        return False, log
     logger.info('successfully compiled project')
 
     return True, ''
 
 
-def run_tests(template_dir: Path, n_proc: int, unit_test_name: str) -> tuple[bool, str]:
-    """执行单元测试"""
+def configure_tests(template_dir: Path) -> tuple[bool, str]:
+    """配置单元测试的 CMake 项目，只依赖源代码，可以与主项目的编译同时进行"""
     test_build_dir = template_dir / 'test' / 'build'
+    env = _cmake_env(template_dir)
 
     try:
         # 1. 创建测试build目录
@@ -97,46 +205,54 @@ def run_tests(template_dir: Path, n_proc: int, unit_test_name: str) -> tuple[boo
         logger.info('directory test/build/ created')
 
         # 2. 执行cmake配置
-        cmake_process = subprocess.run(
-            ['cmake', '-S', str(template_dir / 'test'), '-B', str(test_build_dir)],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            check=False,
-            text=True
+        if not _needs_configure(test_build_dir, template_dir / 'test'):
+            logger.info('CMake test target already configured')
+            return True, ''
+        success, log = _run_logged(
+            [_CMAKE, '-S', str(template_dir / 'test'), '-B', str(test_build_dir),
+             *_launcher_args()],
+            test_build_dir / 'configure.log',
+            env
         )
-        if cmake_process.returncode != 0:
+        if not success:
             logger.warning('failed to configure CMake test target')
-            return False, cmake_process.stdout
+            return False, log
         logger.info('CMake test target configured')
 
-        # 3. 编译测试程序
-        build_process = subprocess.run(
-            ['cmake', '--build', str(test_build_dir),
+        return True, ''
+
+    except Exception as e:
+        return False, str(e)
+
+
+def run_tests(template_dir: Path, n_proc: int, unit_test_name: str) -> tuple[bool, str]:
+    """编译并执行单元测试，测试项目必须已经由 `configure_tests` 配置好"""
+    test_build_dir = template_dir / 'test' / 'build'
+    env = _cmake_env(template_dir)
+
+    try:
+        # 1. 编译测试程序
+        success, log = _run_logged(
+            [_CMAKE, '--build', str(test_build_dir),
              '--config', 'Release',
              '--target', 'test',
              '--parallel', str(n_proc)],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            check=False,
-            text=True
+            test_build_dir / 'build.log',
+            env
         )
-        if build_process.returncode != 0:
+        if not success:
             logger.warning('failed to compile test program')
-            return False, build_process.stdout
+            return False, log
         logger.info('test program compiled')
 
-        # 4. 执行测试
-        test_process = subprocess.run(
+        # 2. 执行测试
+        success, log = _run_logged(
             [str(test_build_dir / 'test'), unit_test_name],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            check=False,
-            text=True
+            test_build_dir / 'test.log'
         )
-
-        if test_process.returncode != 0:
+        if not success:
             logger.warning('unit test failed')
-            return False, test_process.stdout
+            return False, log
         logger.info('unit test passed')
 
         return True, ''
@@ -147,82 +263,62 @@ def run_tests(template_dir: Path, n_proc: int, unit_test_name: str) -> tuple[boo
 
 def extract_and_log_functions(
     template_dir: Path,
-    function_requirements_json: str
+    requirements_data: List[Dict[str, Any]]
 ) -> Optional[List[str]]:
     """
     提取并记录函数实现
 
     :param template_dir: 模板目录路径
-    :param function_requirements_json: 函数需求信息的JSON字符串
+    :param requirements_data: Web 服务端返回的函数需求信息列表
     :return: 如果提取成功，返回所有函数实现组成的列表，未找到任何一个指定的函数实现则返回 `None`
     :raises RuntimeError: 当提取流程出现错误时抛出
     """
     try:
-        requirements_data = json.loads(function_requirements_json)
-        function_impls = []
-
         # 将字典数据转换为函数需求对象
-        function_requirements = []
-        for req_data in requirements_data:
-            # 解析函数签名
-            sig_data = req_data['function_signature']
-            parameters = [
-                FunctionParameter(param['name'], param['type'])
-                for param in sig_data['parameters']
-            ]
-            function_signature = FunctionSignature(
-                sig_data['return_type'],
-                sig_data['name'],
-                parameters
-            )
+        function_requirements = [parse_function_requirement(data) for data in requirements_data]
 
-            # 创建函数需求对象
-            requirement = FunctionRequirement(
-                req_data['id'],
-                req_data['source_file_path'],
-                function_signature
-            )
-            function_requirements.append(requirement)
+        logger.info('%d function requirements parsed', len(function_requirements))
 
-        logger.info(
-            f'{len(function_requirements)} function requirements parsed form command-line arg'
-        )
-
-        # 提取每个函数的实现
+        # 按源文件分组提取函数的实现，每个源文件只需要解析一次
         build_dir = template_dir / 'build'
-        for requirement in function_requirements:
+        requirements_by_file: Dict[Path, List[int]] = {}
+        for i, requirement in enumerate(function_requirements):
             source_file_path = template_dir / requirement.source_file_path
-            logger.info(
-                f'try to extract {requirement.function_signature.name} from {source_file_path}'
-            )
-
             if not source_file_path.exists():
                 raise RuntimeError(f'source file {source_file_path} not found')
+            requirements_by_file.setdefault(source_file_path, []).append(i)
 
-            try:
-                # 提取函数实现
-                implementation = extract_function_implementation(
-                    source_file_path,
-                    requirement.function_signature,
-                    build_dir
-                )
+        jobs = [
+            (source_file_path, [function_requirements[i].function_signature for i in indices])
+            for source_file_path, indices in requirements_by_file.items()
+        ]
+        for source_file_path, signatures in jobs:
+            logger.info(
+                'try to extract %s from %s',
+                ', '.join(signature.name for signature in signatures),
+                source_file_path
+            )
 
+        try:
+            # 不同源文件互不依赖，交给当前验证进程中常驻的进程池并行地提取函数实现；
+            # 重新评测相同的代码时直接使用缓存的结果
+            results = extract_many_parallel(jobs, build_dir)
+        except RuntimeError as e:
+            # 重新抛出 RuntimeError
+            logger.error('unexpected error occurred when extracting functions: %s: %s', type(e), e)
+            raise
+
+        function_impls: List[Optional[str]] = [None] * len(function_requirements)
+        for indices, (_, signatures), implementations in zip(
+            requirements_by_file.values(), jobs, results
+        ):
+            for i, signature, implementation in zip(indices, signatures, implementations):
                 if implementation is None:
-                    logger.warning(
-                        f'implementation of {requirement.function_signature.name} not found'
-                    )
+                    logger.warning('implementation of %s not found', signature.name)
                     return None
-                else:
-                    # 输出函数实现到日志
-                    logger.info(f'found implementation of {requirement.function_signature.name}')
-                    function_impls.append(implementation)
-            except RuntimeError as e:
-                # 重新抛出 RuntimeError
-                logger.error(
-                    'unexpected error occurred when extracting '
-                    f'{requirement.function_signature.name}: {type(e)}: {str(e)}'
-                )
-                raise
+                # 输出函数实现到日志
+                logger.info('found implementation of %s', signature.name)
+                function_impls[i] = implementation
 
         return function_impls
 
@@ -231,7 +327,7 @@ def extract_and_log_functions(
         raise
     except Exception as e:
         # 其他异常转换为 RuntimeError 并抛出
-        logger.error(f'unexpected error occurred during extraction: {type(e)}: {str(e)}')
+        logger.error('unexpected error occurred during extraction: %s: %s', type(e), e)
         raise RuntimeError('failed to extract function implementation')
 
 
@@ -239,7 +335,7 @@ def main(
     judgment_id: int,
     temp_dir_path: str,
     unit_test_name: Optional[str] = None,
-    function_requirements_json: Optional[str] = None
+    function_requirements: Optional[List[Dict[str, Any]]] = None
 ):
     """执行Dandelion项目验证并提交结果"""
     # 使用传入的临时目录路径
@@ -247,23 +343,31 @@ def main(
     n_proc = Config.PARALLEL_BUILD
 
     try:
-        # 执行项目编译
-        compile_success, compile_log = compile_project(template_dir, n_proc)
-        if not compile_success:
-            return submit_result(judgment_id, 'failed', compile_log)
-
-        # 执行单元测试（如果提供测试名称）
-        if unit_test_name:
-            test_success, test_log = run_tests(template_dir, n_proc, unit_test_name)
-            if not test_success:
-                return submit_result(judgment_id, 'failed', test_log)
-
-        # 提取函数实现（如果提供了描述需求的 JSON）
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            # 测试项目的配置不依赖主项目的编译结果，与主项目的编译同时进行
+            test_configure_future = None
+            if unit_test_name:
+                test_configure_future = pool.submit(configure_tests, template_dir)
+
+            # 执行项目编译
+            compile_success, compile_log = compile_project(template_dir, n_proc)
+            if not compile_success:
+                return submit_result(judgment_id, 'failed', compile_log)
+
+            # 执行单元测试（如果提供测试名称）
+            if test_configure_future is not None:
+                test_success, test_log = test_configure_future.result()
+                if test_success:
+                    test_success, test_log = run_tests(template_dir, n_proc, unit_test_name)
+                if not test_success:
+                    return submit_result(judgment_id, 'failed', test_log)
+
+        # 提取函数实现（如果提供了函数需求信息）
         function_impls = None
-        if function_requirements_json is not None:
+        if function_requirements is not None:
             function_impls = extract_and_log_functions(
                 template_dir,
-                function_requirements_json
+                function_requirements
             )
             if function_impls is None:
                 return submit_result(judgment_id, 'failed', '未找到题目要求的所有函数实现')
@@ -272,15 +376,69 @@ def main(
         submit_result(judgment_id, 'passed', '', function_impls)
 
     except Exception as e:
-        logger.warning(f'unexpected error occurred: {type(e)}: {str(e)}')
+        logger.warning('unexpected error occurred: %s: %s', type(e), e)
         # 捕获所有异常，返回error状态
         submit_result(judgment_id, 'error', str(e))
 
     finally:
         # 清理整个临时目录
         if template_dir.exists():
-            shutil.rmtree(template_dir, ignore_errors=True)
-        logger.info(f'judgment {judgment_id} done')
+            try:
+                _reaper.discard(template_dir)
+            except OSError:
+                shutil.rmtree(template_dir, ignore_errors=True)
+        logger.info('judgment %s done', judgment_id)
+
+
+def run_job(job: Dict[str, Any]) -> None:
+    """
+    执行一个评测任务，评测日志输出到 `LOG_DIR` 下的 `[judgment-id].log` 文件中
+
+    :param job: 执行节点分发的评测任务，包含 `judgment_id`、`temp_dir`、`unit_test` 和
+        `function_requirements` 字段
+    """
+    judgment_id = job['judgment_id']
+    handler = logging.FileHandler(Path(Config.LOG_DIR) / f'{judgment_id}.log')
+    handler.setFormatter(logging.Formatter(Config.LOG_FORMAT))
+    # 验证进程是常驻的，每个评测任务的日志都要单独输出到自己的日志文件
+    root_logger = logging.getLogger()
+    root_logger.addHandler(handler)
+    try:
+        main(
+            judgment_id,
+            job['temp_dir'],
+            job.get('unit_test'),
+            job.get('function_requirements')
+        )
+    finally:
+        root_logger.removeHandler(handler)
+        handler.close()
+
+
+def serve(job_queue: Queue) -> None:
+    """
+    常驻验证进程的入口，不断从队列中取出评测任务并执行，取到 `None` 时退出
+
+    :param job_queue: 执行节点分发评测任务的队列
+    """
+    logging.getLogger().setLevel(logging.DEBUG)
+    # 验证进程池用 SIGTERM 终止验证进程；转换为正常退出，以便回收函数提取进程池中的工作进程
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while True:
+            job = job_queue.get()
+            if job is None:
+                break
+            try:
+                run_job(job)
+            except Exception as e:
+                # 单个任务出错（如无法写入日志）不能影响后续任务
+                logger.error(
+                    'failed to run judgment %s: %s: %s', job.get('judgment_id'), type(e), e
+                )
+    finally:
+        # multiprocessing 创建的进程退出时不执行 atexit 注册的函数，需要在这里关闭进程池
+        shutdown_pool()
 
 
 if __name__ == '__main__':
@@ -289,7 +447,9 @@ if __name__ == '__main__':
     parser.add_argument('--judgment-id', type=int, required=True, help='评测ID')
     parser.add_argument('--temp-dir', type=str, required=True, help='临时目录路径')
     parser.add_argument('--unit-test', type=str, help='单元测试名称')
-    parser.add_argument('--function-requirements', type=str, help='函数需求信息的JSON字符串')
+    parser.add_argument(
+        '--function-requirements-file', type=Path, help='保存函数需求信息的 JSON 文件路径'
+    )
 
     args = parser.parse_args()
     logging.basicConfig(
@@ -298,9 +458,15 @@ if __name__ == '__main__':
         filename=Path(Config.LOG_DIR) / f'{args.judgment_id}.log'
     )
 
+    function_requirements = None
+    if args.function_requirements_file is not None:
+        function_requirements = json.loads(args.function_requirements_file.read_text())
+
     main(
         args.judgment_id,
         args.temp_dir,
         args.unit_test,
-        args.function_requirements
+        function_requirements
     )
+    # 进程退出前等待后台删除完成，否则守护线程会随进程退出而中断
+    _reaper.join()
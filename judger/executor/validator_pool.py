@@ -0,0 +1,101 @@
+"""
+验证进程池模块
+
+执行节点把评测任务通过队列分发给常驻的验证进程，避免每次评测都冷启动一个新的 Python 解释器。
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+from multiprocessing.process import BaseProcess
+from multiprocessing.queues import Queue
+from typing import Optional, List, Dict, Any
+from judger.executor import validate
+from judger.executor.mp_context import get_mp_context
+
+
+logger = logging.getLogger('validator_pool')
+
+# 关闭进程池时等待验证进程退出的最长时间（以秒计）
+SHUTDOWN_TIMEOUT = 10
+
+
+class ValidatorPool:
+    """常驻验证进程池
+
+    进程池在第一次提交任务时才在当前进程中启动。gunicorn 在创建 Flask 应用之后才 fork 出工作进程，
+    延迟启动可以保证每个工作进程只管理（终止、回收）自己创建的验证进程。
+    """
+
+    def __init__(self, n_workers: int):
+        """
+        初始化验证进程池
+
+        :param n_workers: 常驻验证进程的数量
+        """
+        self.n_workers = n_workers
+        self._lock = threading.Lock()
+        self._owner_pid: Optional[int] = None
+        self._queue: Optional[Queue] = None
+        self._processes: List[BaseProcess] = []
+
+    def submit(self, job: Dict[str, Any]) -> None:
+        """
+        提交一个评测任务，任务会由某个空闲的验证进程执行
+
+        :param job: 评测任务，字段见 `judger.executor.validate.run_job`
+        """
+        self._ensure_started()
+        self._queue.put(job)
+
+    def _ensure_started(self) -> None:
+        """如果当前进程还没有启动验证进程，则启动它们；已经启动时替换意外退出的验证进程"""
+        with self._lock:
+            if self._owner_pid == os.getpid():
+                self._respawn_dead()
+                return
+            self._queue = get_mp_context().Queue()
+            self._processes = [self._spawn() for _ in range(self.n_workers)]
+            self._owner_pid = os.getpid()
+            atexit.register(self.shutdown)
+            logger.info('%d validator processes started', self.n_workers)
+
+    def _spawn(self) -> BaseProcess:
+        """启动一个从队列中取评测任务的验证进程"""
+        # 验证进程由一个精简的 forkserver 进程 fork 出来，而不是直接 fork Flask 应用所在的进程，
+        # 避免复制后者的全部页表；forkserver 预先导入验证脚本，新的验证进程无需重新导入
+        process = get_mp_context().Process(target=validate.serve, args=(self._queue,))
+        process.start()
+        return process
+
+    def _respawn_dead(self) -> None:
+        """回收意外退出（如段错误、内存不足被杀死）的验证进程，并启动新的验证进程代替它们"""
+        for i, process in enumerate(self._processes):
+            if process.is_alive():
+                continue
+            process.join()
+            logger.error(
+                'validator process %d exited unexpectedly with code %s, restarting it',
+                process.pid, process.exitcode
+            )
+            self._processes[i] = self._spawn()
+
+    def shutdown(self) -> None:
+        """终止并回收所有验证进程，只有启动它们的进程才能执行此操作"""
+        if self._owner_pid != os.getpid():
+            return
+        for process in self._processes:
+            process.terminate()
+        # 验证进程收到 SIGTERM 后回收自己的函数提取进程再退出；卡住（如构建没有响应）的验证进程
+        # 不能无限期地阻止工作进程退出，等待超时后强制杀死它
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        for process in self._processes:
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                logger.warning('validator process %d does not exit, killing it', process.pid)
+                process.kill()
+                process.join()
+        self._processes = []
+        self._owner_pid = None
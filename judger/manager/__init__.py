@@ -1,20 +1,63 @@
-import json
+import socket
+from datetime import datetime
 from typing import Optional, Dict, List, Any
 from flask import Flask, request, jsonify, current_app
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from judger.utils.token_manager import TokenManager
-from judger.utils.api_client import APIClient
 from judger.manager.config import Config
-from judger.manager.models import db, Executor, Task
+from judger.manager.models import db, Executor, Task, check_sqlite_version
+from judger.manager.forwarder import ResultForwarder
 from logging import Formatter
 
 
+def _notify_distributor() -> None:
+    """
+    唤醒分发脚本，让它立即检查任务队列和空闲的执行节点
+
+    分发脚本没有运行或者积压的唤醒消息太多时直接忽略，分发脚本仍然会定期检查。
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.sendto(b'\0', socket.MSG_DONTWAIT, current_app.config['DISPATCH_SOCKET'])
+    except OSError:
+        pass
+
+
+def _find_executor(ip: str) -> Optional[Executor]:
+    """
+    根据 IP 查找执行节点，优先通过缓存的节点 ID 按主键查找
+
+    分发脚本可能删除失联的节点，SQLite 也可能把被删除节点的 ID 分配给新节点，
+    所以按缓存的 ID 找到节点后还要检查它的 IP。
+
+    :param ip: 执行节点 IP
+    :return: 执行节点，不存在时返回 None
+    """
+    executor_id = current_app.executor_ids.get(ip)
+    if executor_id is not None:
+        executor = db.session.get(Executor, executor_id)
+        if executor is not None and executor.ip == ip:
+            return executor
+    executor = Executor.query.filter_by(ip=ip).first()
+    if executor is None:
+        current_app.executor_ids.pop(ip, None)
+    else:
+        current_app.executor_ids[ip] = executor.id
+    return executor
+
+
 def create_app(test_config: Optional[Dict] = None) -> Flask:
+    check_sqlite_version()
     app = Flask(__name__)
     app.token_manager = TokenManager('manager')
     app.config.from_object(Config)
     if test_config is not None:
         app.config.from_mapping(test_config)
 
+    app.result_forwarder = ResultForwarder(app)
+    # {执行节点 IP: 执行节点 ID}
+    app.executor_ids: Dict[str, int] = {}
+
     # Configure logging format
     formatter = Formatter('[%(levelname)s][%(name)s][%(asctime)s] %(message)s')
     for handler in app.logger.handlers:
@@ -38,6 +81,7 @@ def create_app(test_config: Optional[Dict] = None) -> Flask:
             current_app.logger.info(
                 f'task {new_task.id} (judgment {judgment_id}) added to task queue'
             )
+            _notify_distributor()
         except Exception as e:
             current_app.logger.error(f'cannot add new task to queue: {type(e)}: {str(e)}')
             db.session.rollback()
@@ -47,24 +91,26 @@ def create_app(test_config: Optional[Dict] = None) -> Flask:
 
     # 初始化数据库
     db.init_app(app)
+    # 命令行启动管理节点时，应用只在 gunicorn 的主进程中 fork 出工作进程之前创建一次，
+    # 数据库表也只在这里重建一次，工作进程不会重建数据库表而清掉其他工作进程写入的数据
     with app.app_context():
+        # 管理节点的数据库只用来实现 IPC，上次运行留下的数据都没有意义；
+        # 重新建表而不是清空数据，这样旧版本留下的数据库文件也会使用新的表结构
+        db.drop_all()
         db.create_all()
-
-        # 管理节点的数据库只用来实现 IPC，上次运行留下的数据都没有意义
-        meta = db.metadata
-        for table in reversed(meta.sorted_tables):
-            db.session.execute(table.delete())
-        db.session.commit()
+        # 应用在 gunicorn fork 出工作进程之前创建，不能让工作进程继承连接池中的连接
+        db.session.remove()
+        db.engine.dispose()
 
     @app.route('/api/judge/<int:judgment_id>/result', methods=['POST'])
     def receive_judgment_result(judgment_id: int):
         """
-        接收评测结果，重置执行节点空闲状态，并将结果转发给 Web 服务端。
+        接收评测结果，重置执行节点空闲状态，并在后台将结果转发给 Web 服务端。
 
         该 API 由执行节点在完成任务后调用，返回 200 表示管理节点成功收到了执行节点的反馈。
         """
         ip = request.remote_addr
-        executor = Executor.query.filter_by(ip=ip).first()
+        executor = _find_executor(ip)
         if executor is None:
             return jsonify({'error': 'Executor not found'}), 404
 
@@ -72,6 +118,7 @@ def create_app(test_config: Optional[Dict] = None) -> Flask:
         executor.idle = True
         try:
             db.session.commit()
+            _notify_distributor()
 
             # 获取请求体中的评测结果
             result_data: Dict[str, Any] = request.get_json()
@@ -83,28 +130,8 @@ def create_app(test_config: Optional[Dict] = None) -> Flask:
             }
             function_impls: List[str] | None = result_data.get('function_impls', None)
 
-            api_client = APIClient(current_app.token_manager)
-            judgment: Dict[str, Any] = api_client.get(f'/api/judgments/{judgment_id}')
-            submission_id = judgment['submission_id']
-
-            try:
-                # 将评测结果转发给Web服务端
-                api_client.post(f'/api/judgments/{judgment_id}/result', data=judgment_result)
-                if function_impls is not None:
-                    for function_impl in function_impls:
-                        response = api_client.post(
-                            f'/api/submissions/{submission_id}/function_impls',
-                            data={'code': function_impl}
-                        )
-                        function_impl_id = response['function_impl_id']
-                        current_app.logger.info(
-                            f'function implementation sent to Web server, ID: {function_impl_id}'
-                        )
-            except Exception as api_error:
-                # 更新 Web 服务端信息失败，但这和执行节点没有关系
-                current_app.logger.error(
-                    f'failed to update judgment result: {type(api_error)}: {str(api_error)}'
-                )
+            # 在后台将评测结果转发给Web服务端，执行节点不必等待
+            current_app.result_forwarder.submit(judgment_id, judgment_result, function_impls)
 
             return '', 200
         except Exception as e:
@@ -128,22 +155,25 @@ def create_app(test_config: Optional[Dict] = None) -> Flask:
             current_app.logger.warning('no status data')
             return jsonify({'error': 'invalid JSON data'}), 400
 
-        try:
-            json_data = json.dumps(data)
-        except TypeError:
-            return jsonify({'error': 'invalid JSON format'}), 400
-
-        executor = Executor.query.filter_by(ip=ip).first()
-        if not executor:
-            current_app.logger.info('create a new executor node')
-            executor = Executor(ip=ip, data=json_data)
-            db.session.add(executor)
-        else:
-            executor.data = json_data
-            current_app.logger.info(f'update executor to {executor}')
+        # 请求体已经是合法的 JSON，直接保存原始内容，不必再序列化一次
+        json_data = request.get_data(as_text=True)
+
+        is_alive = isinstance(data, dict) and bool(data.get('is_alive', False))
+        # 用一条 UPSERT 语句创建或更新执行节点，不必先查询节点是否存在
+        now = datetime.now()
+        statement = sqlite_insert(Executor).values(
+            ip=ip, data=json_data, is_alive=is_alive, last_updated=now
+        ).on_conflict_do_update(
+            index_elements=[Executor.ip],
+            set_={'data': json_data, 'is_alive': is_alive, 'last_updated': now}
+        ).returning(Executor.id)
 
         try:
+            executor_id = db.session.execute(statement).scalar_one()
             db.session.commit()
+            current_app.executor_ids[ip] = executor_id
+            current_app.logger.info(f'executor {executor_id} at {ip} updated, alive: {is_alive}')
+            _notify_distributor()
         except Exception as e:
             db.session.rollback()
             current_app.logger.error(
@@ -3,9 +3,17 @@ import os
 
 class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('SQLALCHEMY_DATABASE_URI') or 'sqlite:///judger.db'
+    # Keep warm SQLite connections in each worker process instead of opening one per request
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': 10,
+        'max_overflow': 20,
+        'connect_args': {'check_same_thread': False},
+    }
     WEB_SERVER_IP = os.environ.get('WEB_SERVER_IP') or '127.0.0.1'
-    WEB_SERVER_PORT = os.environ.get('WEB_SERVER_PORT') or '8000'
+    WEB_SERVER_PORT = int(os.environ.get('WEB_SERVER_PORT') or 8000)
     # Account and password for login to the Web backend
     WEB_ACCOUNT = os.environ.get('WEB_ACCOUNT')
     WEB_PASSWORD = os.environ.get('WEB_PASSWORD')
-    EXECUTOR_PORT = os.environ.get('EXECUTOR_PORT') or '10011'
+    EXECUTOR_PORT = int(os.environ.get('EXECUTOR_PORT') or 10011)
+    # Datagram socket used to wake up the distributor as soon as a task or an executor becomes ready
+    DISPATCH_SOCKET = os.environ.get('DISPATCH_SOCKET') or '/tmp/judger-dispatch.sock'
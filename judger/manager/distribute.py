@@ -1,9 +1,14 @@
-import json
+import os
+import socket
 import sqlite3
 import time
 import requests
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple
 from judger.manager.config import Config
+from judger.manager.models import set_sqlite_pragmas, check_sqlite_version
+from judger.utils.http_session import create_session
 
 
 logger = logging.getLogger('distribute')
@@ -13,92 +18,182 @@ logging.basicConfig(
 )
 
 
+# 同时发送评测请求的最大数量
+MAX_CONCURRENT_REQUESTS = 32
+
+# 复用到各执行节点的连接，每个执行节点同一时间只会收到一个评测请求
+_session = create_session(pool_maxsize=1, pool_connections=MAX_CONCURRENT_REQUESTS)
+
+# 没有被唤醒时，最多等待这么长时间（以秒计）再检查一次任务队列
+POLL_INTERVAL = 5
+
+
+def bind_wakeup_socket(path: str) -> socket.socket | None:
+    """
+    绑定用于唤醒分发脚本的 UNIX 数据报套接字，管理节点在有新任务或有执行节点空闲时向它发送消息
+
+    :param path: 套接字路径
+    :return: 绑定好的套接字，绑定失败时返回 None，此时分发脚本退回到定期轮询
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        # 删除上次运行留下的套接字文件
+        if os.path.exists(path):
+            os.unlink(path)
+        sock.bind(path)
+    except OSError as e:
+        logger.warning(f'cannot bind wakeup socket {path}, fall back to polling: {str(e)}')
+        sock.close()
+        return None
+    return sock
+
+
+def wait_for_wakeup(sock: socket.socket | None, timeout: float) -> None:
+    """
+    等待唤醒消息，最多等待 `timeout` 秒，收到消息后取出所有积压的消息，多次唤醒只触发一次分发
+
+    :param sock: 唤醒套接字，为 None 时直接等待 `timeout` 秒
+    :param timeout: 最长等待时间（以秒计）
+    """
+    if sock is None:
+        time.sleep(timeout)
+        return
+    sock.settimeout(timeout)
+    try:
+        sock.recv(1)
+    except TimeoutError:
+        return
+    sock.setblocking(False)
+    try:
+        while True:
+            sock.recv(1)
+    except BlockingIOError:
+        pass
+
+
 def distribute_tasks():
+    check_sqlite_version()
     # 获取数据库路径
     db_path = Config.SQLALCHEMY_DATABASE_URI.split('///')[1]
+    wakeup_socket = bind_wakeup_socket(Config.DISPATCH_SOCKET)
+    # 分发脚本是常驻的，整个运行期间使用同一个数据库连接
+    conn = sqlite3.connect(db_path)
+    set_sqlite_pragmas(conn)
 
     while True:
-        # 每5秒检查一次
-        time.sleep(5)
         try:
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-
-            # 检查任务
-            cursor.execute('SELECT id, judgment_id FROM tasks ORDER BY id ASC LIMIT 1')
-            task = cursor.fetchone()
-
-            if task is None:
-                logger.info('task queue is empty')
+            # 任务或执行节点的状态发生变化后可能还有任务可以分配，立即再检查一次
+            if dispatch(conn):
                 continue
-            task_id, judgment_id = task
-
-            # 获取所有空闲节点及其状态数据
-            cursor.execute('SELECT id, ip, data FROM executors WHERE idle=1')
-            idle_executors = cursor.fetchall()
-
-            chosen_executor = None
-            for executor in idle_executors:
-                executor_id, executor_ip, data_json = executor
-                try:
-                    # 解析 data 字段的 JSON
-                    data = json.loads(data_json)
-                    # 检查 is_alive 属性，找到第一个在线的执行节点
-                    if data.get('is_alive', False):
-                        chosen_executor = (executor_id, executor_ip)
-                        break
-                except json.JSONDecodeError:
-                    logger.error(f'cannot parse \"data\" field of executor {executor_id}')
-                    handle_failed_executor(cursor, conn, executor_id)
-                    continue
-
-            if chosen_executor is None:
-                logger.warning('no idle executor node is available')
-                continue
-            executor_id, executor_ip = chosen_executor
-
-            try:
-                # 发送请求（5秒超时）
-                url = f'http://{executor_ip}:{Config.EXECUTOR_PORT}' \
-                    + f'/api/judge/{judgment_id}'
-                response = requests.post(url, timeout=5)
-
-                if response.status_code == 202:
-                    # 标记节点忙碌
-                    cursor.execute('UPDATE executors SET idle=0 WHERE id=?', (executor_id,))
-                    # 删除任务
-                    cursor.execute('DELETE FROM tasks WHERE id=?', (task_id,))
-                    conn.commit()
-                    logger.info(
-                        f'task (judgment ID: {judgment_id}) assigned to '
-                        f'executor {executor_id} at {executor_ip}'
-                    )
-                else:
-                    # 评测节点返回异常状态码，无法执行评测
-                    logger.warning(
-                        f'response from executor {executor_id} (at {executor_ip}): '
-                        f'{response.status_code} {response.content}'
-                    )
-                    handle_failed_executor(cursor, conn, executor_id)
-            except requests.exceptions.Timeout:
-                # 评测请求超时则认为该执行节点已经失联，清除数据库记录
-                logger.warning(f'executor {executor_id} timeout')
-                handle_failed_executor(cursor, conn, executor_id)
-            except requests.exceptions.RequestException as e:
-                logger.warning(f'RequestException: {str(e)}')
-                handle_failed_executor(cursor, conn, executor_id)
-
-            conn.close()
         except sqlite3.Error as e:
             logger.error(f'database error: {str(e)}')
-
-
-def handle_failed_executor(cursor, conn, executor_id):
-    """处理失败节点"""
-    # 删除节点
-    cursor.execute('DELETE FROM executors WHERE id=?', (executor_id,))
+            # 放弃未提交的事务，不能一直持有写锁阻塞管理节点写入数据库
+            conn.rollback()
+        # 有新任务或执行节点空闲时立即被唤醒，否则每 POLL_INTERVAL 秒检查一次
+        wait_for_wakeup(wakeup_socket, POLL_INTERVAL)
+
+
+def dispatch(conn: sqlite3.Connection) -> bool:
+    """
+    将任务队列中最早的若干个任务分别分配给在线的空闲执行节点，同时向这些执行节点发送评测请求。
+    任务和执行节点在同一个事务中被取出和标记为忙碌，之后再发送评测请求
+
+    :param conn: 数据库连接
+    :return: 是否分配了任务，此时可能还有任务可以立即分配
+    """
+    cursor = conn.cursor()
+
+    # 取出任务，每个在线的空闲执行节点最多分配一个任务。
+    # 任务在发送评测请求之前就从队列中取出，发送失败时再放回队列；
+    # DELETE 语句开始了写事务，之后认领执行节点时其他分发进程不能同时修改这两张表
+    cursor.execute(
+        'DELETE FROM tasks WHERE id IN ('
+        '  SELECT id FROM tasks ORDER BY id ASC LIMIT ('
+        '    SELECT COUNT(*) FROM executors WHERE idle=1 AND is_alive=1'
+        '  )'
+        ') RETURNING id, judgment_id'
+    )
+    # RETURNING 返回的行没有确定的顺序
+    tasks = sorted(cursor.fetchall())
+
+    # 在同一个事务中把与任务数相同的空闲节点原子地标记为忙碌
+    executors = []
+    if tasks:
+        cursor.execute(
+            'UPDATE executors SET idle=0 WHERE id IN ('
+            '  SELECT id FROM executors WHERE idle=1 AND is_alive=1 ORDER BY id ASC LIMIT ?'
+            ') RETURNING id, ip',
+            (len(tasks),)
+        )
+        executors = sorted(cursor.fetchall())
+    else:
+        logger.info('no task queued or no idle executor node available')
+
+    assignments = list(zip(tasks, executors))
+    # 发送评测请求期间不能持有写锁，否则会阻塞管理节点写入数据库
     conn.commit()
-    logger.warning(f'executor {executor_id} has been removed')
+
+    if not assignments:
+        return False
+
+    # 并发地向各执行节点发送评测请求
+    failed_assignments = []
+    with ThreadPoolExecutor(max_workers=min(len(assignments), MAX_CONCURRENT_REQUESTS)) as pool:
+        results = pool.map(lambda assignment: send_task(*assignment), assignments)
+        for assignment, success in zip(assignments, results):
+            if not success:
+                failed_assignments.append(assignment)
+
+    if failed_assignments:
+        # 发送失败的任务以原来的 ID 放回队列，仍然按原来的顺序分配；删除失败节点
+        cursor.executemany(
+            'INSERT INTO tasks (id, judgment_id) VALUES (?, ?)',
+            [task for task, _ in failed_assignments]
+        )
+        cursor.executemany(
+            'DELETE FROM executors WHERE id=?',
+            [(executor_id,) for _, (executor_id, _) in failed_assignments]
+        )
+        conn.commit()
+        for _, (executor_id, _) in failed_assignments:
+            logger.warning(f'executor {executor_id} has been removed')
+
+    return True
+
+
+def send_task(task: Tuple[int, int], executor: Tuple[int, str]) -> bool:
+    """
+    向执行节点发送评测请求
+
+    :param task: (任务 ID, 评测 ID)
+    :param executor: (执行节点 ID, 执行节点 IP)
+    :return: 执行节点是否接受了评测任务
+    """
+    _, judgment_id = task
+    executor_id, executor_ip = executor
+    try:
+        # 发送请求（5秒超时）
+        url = f'http://{executor_ip}:{Config.EXECUTOR_PORT}' \
+            + f'/api/judge/{judgment_id}'
+        response = _session.post(url, timeout=5)
+
+        if response.status_code == 202:
+            logger.info(
+                f'task (judgment ID: {judgment_id}) assigned to '
+                f'executor {executor_id} at {executor_ip}'
+            )
+            return True
+        # 评测节点返回异常状态码，无法执行评测
+        logger.warning(
+            f'response from executor {executor_id} (at {executor_ip}): '
+            f'{response.status_code} {response.content}'
+        )
+    except requests.exceptions.Timeout:
+        # 评测请求超时则认为该执行节点已经失联，清除数据库记录
+        logger.warning(f'executor {executor_id} timeout')
+    except requests.exceptions.RequestException as e:
+        logger.warning(f'RequestException: {str(e)}')
+    return False
 
 
 if __name__ == '__main__':
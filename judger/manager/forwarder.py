@@ -0,0 +1,96 @@
+import atexit
+import os
+import queue
+import threading
+from typing import Optional, Dict, List, Any
+from flask import Flask
+from judger.utils.api_client import APIClient
+
+
+class ResultForwarder:
+    """在后台线程中将评测结果转发给 Web 服务端的工具类
+
+    管理节点收到执行节点的评测结果后立即响应，执行节点不必等待转发完成就可以接受下一个评测任务。
+    """
+
+    def __init__(self, app: Flask, n_workers: int = 4):
+        """
+        :param app: 管理节点的 Flask 应用，转发时在它的应用上下文中访问 Web 服务端
+        :param n_workers: 后台线程数
+        """
+        self.app = app
+        self.n_workers = n_workers
+        self._lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue()
+        self._owner_pid: Optional[int] = None
+
+    def submit(
+        self,
+        judgment_id: int,
+        judgment_result: Dict[str, Any],
+        function_impls: Optional[List[str]]
+    ) -> None:
+        """提交一个要转发的评测结果
+
+        :param judgment_id: 评测 ID
+        :param judgment_result: 评测结果，包含 `result` 和 `log` 字段
+        :param function_impls: 提取出的函数实现，没有时为 None
+        """
+        self._ensure_started()
+        self._queue.put((judgment_id, judgment_result, function_impls))
+
+    def join(self) -> None:
+        """等待所有已提交的评测结果转发完成"""
+        self._queue.join()
+
+    def _ensure_started(self):
+        """如果当前进程中还没有后台转发线程，则启动它们"""
+        with self._lock:
+            if self._owner_pid == os.getpid():
+                return
+            # 应用在 gunicorn fork 出工作进程之前创建，需要在工作进程中启动线程
+            self._queue = queue.Queue()
+            for _ in range(self.n_workers):
+                threading.Thread(target=self._work, args=(self._queue,), daemon=True).start()
+            self._owner_pid = os.getpid()
+            # 工作进程正常退出时转发完已经收到的评测结果
+            atexit.register(self.join)
+
+    def _work(self, results: queue.Queue):
+        """不断从队列中取出评测结果并转发"""
+        while True:
+            judgment_id, judgment_result, function_impls = results.get()
+            try:
+                with self.app.app_context():
+                    self._forward(judgment_id, judgment_result, function_impls)
+            except Exception as e:
+                # 更新 Web 服务端信息失败，但这和执行节点没有关系
+                self.app.logger.error(
+                    f'failed to update judgment result: {type(e)}: {str(e)}'
+                )
+            finally:
+                results.task_done()
+
+    def _forward(
+        self,
+        judgment_id: int,
+        judgment_result: Dict[str, Any],
+        function_impls: Optional[List[str]]
+    ) -> None:
+        """将评测结果和函数实现转发给 Web 服务端"""
+        api_client = APIClient(self.app.token_manager)
+        judgment: Dict[str, Any] = api_client.get(f'/api/judgments/{judgment_id}')
+        submission_id = judgment['submission_id']
+
+        api_client.post(f'/api/judgments/{judgment_id}/result', data=judgment_result)
+        if function_impls is not None:
+            # 函数实现按顺序逐个上传，Web 服务端按创建顺序将它们对应到函数需求
+            for function_impl in function_impls:
+                response = api_client.post(
+                    f'/api/submissions/{submission_id}/function_impls',
+                    data={'code': function_impl}
+                )
+                function_impl_id = response['function_impl_id']
+                self.app.logger.info(
+                    f'function implementation sent to Web server, ID: {function_impl_id}'
+                )
@@ -1,9 +1,56 @@
+import sqlite3
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import String
+from sqlalchemy import String, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import Mapped, DeclarativeBase, mapped_column
 
 
+# 每个 SQLite 连接都要设置的参数：WAL 模式下读取数据库不会阻塞写入；
+# 在 WAL 模式下 synchronous=NORMAL 只在检查点时 fsync，不会在每次提交时 fsync；缓存最多 64 MiB
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-65536',
+)
+
+
+def set_sqlite_pragmas(conn: sqlite3.Connection) -> None:
+    """
+    设置 SQLite 连接的参数，管理节点和分发脚本的连接都要设置
+
+    :param conn: SQLite 连接
+    """
+    cursor = conn.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+# 领取任务用到的 DELETE ... RETURNING 需要 SQLite 3.35，更新执行节点状态用到的 UPSERT 需要 SQLite 3.24
+MIN_SQLITE_VERSION = (3, 35, 0)
+
+
+def check_sqlite_version() -> None:
+    """
+    检查 Python 链接的 SQLite 版本是否支持管理节点用到的语法，管理节点和分发脚本启动时都要检查
+
+    :raises RuntimeError: 当 SQLite 版本过低时抛出
+    """
+    if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+        required = '.'.join(map(str, MIN_SQLITE_VERSION))
+        raise RuntimeError(
+            f'SQLite {required} or later is required (RETURNING and UPSERT clauses), '
+            f'but Python is linked against SQLite {sqlite3.sqlite_version}'
+        )
+
+
+@event.listens_for(Engine, 'connect')
+def _on_connect(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        set_sqlite_pragmas(dbapi_connection)
+
+
 class Base(DeclarativeBase):
     pass
 
@@ -13,6 +60,9 @@ db = SQLAlchemy(model_class=Base)
 
 class Task(db.Model):
     __tablename__ = 'tasks'
+    # 任务 ID 决定分配顺序。AUTOINCREMENT 保证 ID 不会被重复使用，
+    # 分发脚本可以把发送失败的任务以原来的 ID 放回队列，不会与新任务冲突
+    __table_args__ = {'sqlite_autoincrement': True}
 
     id: Mapped[int] = mapped_column(primary_key=True)
     judgment_id: Mapped[int] = mapped_column(nullable=False)
@@ -26,6 +76,8 @@ class Executor(db.Model):
     data: Mapped[str] = mapped_column(nullable=False)
     last_updated: Mapped[datetime] = mapped_column(default=datetime.now, onupdate=datetime.now)
     idle: Mapped[bool] = mapped_column(default=True)  # 节点空闲状态
+    # 节点上的评测服务是否在线，从上报的状态数据中取出，分发脚本不必解析 data 字段
+    is_alive: Mapped[bool] = mapped_column(default=False, index=True)
 
     def __repr__(self):
         return f'Executor (ID: {self.id}, IP: {self.ip}, idle: {self.idle})'
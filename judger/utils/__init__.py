@@ -5,4 +5,6 @@
 - api_client: Web服务端API请求工具
 - token_manager: JWT令牌管理工具
 - template_manager: 模板管理工具
+- dir_reaper: 后台删除目录工具
+- http_session: 复用连接的 HTTP 会话工具
 """
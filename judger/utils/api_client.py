@@ -1,6 +1,10 @@
 from typing import Optional, Dict, Union, List
 import requests
 from judger.utils.token_manager import TokenManager
+from judger.utils.http_session import create_session
+
+# 每次处理请求都会创建新的 APIClient，所有实例共享同一个会话，复用到 Web 服务端的连接
+_session = create_session(pool_maxsize=32)
 
 
 class APIRequestError(Exception):
@@ -24,13 +28,15 @@ class APIClient:
         """
         self.token_manager = token_manager
 
-    def _get_headers(self) -> Dict[str, str]:
+    @staticmethod
+    def _get_headers(access_token: str) -> Dict[str, str]:
         """获取带有JWT的请求头
 
+        :param access_token: 请求使用的 access_token
         :return: 包含Authorization头的字典
         """
         return {
-            'Authorization': f'Bearer {self.token_manager.get_access_token()}'
+            'Authorization': f'Bearer {access_token}'
         }
 
     def _request(self, method: str, endpoint: str, **kwargs) -> requests.Response:
@@ -38,15 +44,17 @@ class APIClient:
 
         :param method: HTTP方法（GET/POST等）
         :param endpoint: API端点路径
-        :param kwargs: 请求参数
+        :param kwargs: 请求参数，其中的 `headers` 会与认证请求头合并
         :return: 原始响应对象
         :raises APIRequestError: 当请求失败时抛出
         """
         url = f'{self.token_manager.get_web_base_url()}{endpoint}'
-        headers = self._get_headers()
+        extra_headers = kwargs.pop('headers', None) or {}
+        access_token = self.token_manager.get_access_token()
+        headers = {**self._get_headers(access_token), **extra_headers}
 
         try:
-            response = requests.request(
+            response = _session.request(
                 method,
                 url,
                 headers=headers,
@@ -54,9 +62,10 @@ class APIClient:
                 **kwargs
             )
             if response.status_code == 401:
-                self.token_manager.refresh_tokens()
-                headers = self._get_headers()
-                response = requests.request(
+                self.token_manager.refresh_tokens(stale_token=access_token)
+                access_token = self.token_manager.get_access_token()
+                headers = {**self._get_headers(access_token), **extra_headers}
+                response = _session.request(
                     method,
                     url,
                     headers=headers,
@@ -80,7 +89,7 @@ class APIClient:
         :param endpoint: API端点路径
         :param params: 查询参数字典
         :param parse_json: 是否解析为JSON
-        :param kwargs: 额外请求参数(如stream=True)
+        :param kwargs: 额外请求参数(如stream=True、headers)
         :return: 如果请求的是文件且请求成功，则返回原始响应对象，其余情况返回解析 JSON 响应体得到的字典或列表
         :raises APIRequestError: 当请求失败时抛出
         """
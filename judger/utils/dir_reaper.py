@@ -0,0 +1,74 @@
+from pathlib import Path
+import os
+import queue
+import shutil
+import threading
+import uuid
+from typing import Optional
+
+
+# 待删除的目录被移入所在目录下的这个子目录，启动时只需要清理这个子目录，
+# 不会误删 TMP_DIR（可能是共用的 /tmp）中其他程序的文件
+GRAVEYARD_NAME = '.gc'
+
+
+class DirectoryReaper:
+    """在后台线程中删除目录的工具类
+
+    要删除的目录先被原子地重命名，再交给后台线程删除，
+    调用者不必等待逐个删除目录中的文件。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue()
+        self._owner_pid: Optional[int] = None
+
+    def discard(self, path: Path) -> None:
+        """将目录移入同级的待删除目录后提交给后台线程删除
+
+        :param path: 要删除的目录
+        """
+        graveyard_dir = path.parent / GRAVEYARD_NAME
+        graveyard_dir.mkdir(exist_ok=True)
+        graveyard = graveyard_dir / f'{path.name}-{uuid.uuid4().hex}'
+        path.rename(graveyard)
+        self._ensure_started()
+        self._queue.put(graveyard)
+
+    def sweep(self, directory: Path) -> None:
+        """将进程在删除完成之前退出而遗留下的目录提交给后台线程删除
+
+        :param directory: 调用过 `discard` 的目录所在的父目录，只清理其中的待删除目录
+        """
+        graveyard_dir = directory / GRAVEYARD_NAME
+        if not graveyard_dir.is_dir():
+            return
+        graveyards = [path for path in graveyard_dir.iterdir() if path.is_dir()]
+        if not graveyards:
+            return
+        self._ensure_started()
+        for graveyard in graveyards:
+            self._queue.put(graveyard)
+
+    def join(self) -> None:
+        """等待所有已提交的目录删除完成"""
+        self._queue.join()
+
+    def _ensure_started(self):
+        """如果当前进程中还没有后台删除线程，则启动它"""
+        with self._lock:
+            if self._owner_pid == os.getpid():
+                return
+            # fork 出的子进程不会继承父进程的线程，需要在子进程中重新启动
+            self._queue = queue.Queue()
+            threading.Thread(target=self._reap, args=(self._queue,), daemon=True).start()
+            self._owner_pid = os.getpid()
+
+    @staticmethod
+    def _reap(paths: queue.Queue):
+        """不断从队列中取出目录并删除"""
+        while True:
+            path = paths.get()
+            shutil.rmtree(path, ignore_errors=True)
+            paths.task_done()
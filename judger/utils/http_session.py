@@ -0,0 +1,24 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+def create_session(pool_maxsize: int = 16, pool_connections: int = 4) -> requests.Session:
+    """创建复用 TCP 连接的 HTTP 会话
+
+    同一个会话发出的请求会复用已经建立的连接，不必每次请求都重新握手；
+    建立连接失败时会以指数退避的间隔重试两次。
+
+    :param pool_maxsize: 每个主机最多保留的连接数
+    :param pool_connections: 最多为多少个主机保留连接
+    :return: HTTP 会话
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        max_retries=Retry(total=2, backoff_factor=0.2)
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
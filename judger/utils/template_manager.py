@@ -1,7 +1,16 @@
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Optional, Iterator
+import contextlib
+import fcntl
+import json
+import os
 import shutil
+import tempfile
+import threading
+import uuid
+import zipfile
 from datetime import datetime
+from filelock import FileLock
 from judger.utils.api_client import APIClient
 from judger.executor.config import Config
 
@@ -17,8 +26,12 @@ class TemplateManager:
         self.api_client = api_client
         self.cache_dir = Path(Config.TMP_DIR) / 'templates'
         self.cache_dir.mkdir(parents=True, exist_ok=True)
-        # 模板缓存字典 {template_id: {'updated_at': str, 'path': Path}}
+        # 模板缓存字典 {template_id: {'updated_at': str, 'etag': str, 'last_modified': str,
+        #                            'path': Path, 'dir_name': str}}
         self.template_cache: Dict[int, Dict] = {}
+        # 每个模板一把锁，同一个模板只由一个线程检查和下载
+        self._locks: Dict[int, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
 
     def get_template(self, template_id: int) -> Dict[str, any]:
         """获取模板信息，必要时下载最新版本
@@ -27,67 +40,186 @@ class TemplateManager:
         :return: 包含模板信息的字典 {'path': Path, 'dir_name': str}
         :raises APIRequestError: 当获取模板失败时抛出
         """
-        # 获取模板信息
-        template_info = self.api_client.get(f'/api/templates/{template_id}')
+        # 带上缓存的 ETag 或 Last-Modified 条件请求模板信息，模板未修改时服务端只返回 304，
+        # 不必再传输和比较模板信息
+        cache_entry = self.template_cache.get(template_id)
+        headers = {}
+        if cache_entry and cache_entry.get('etag'):
+            headers['If-None-Match'] = cache_entry['etag']
+        if cache_entry and cache_entry.get('last_modified'):
+            headers['If-Modified-Since'] = cache_entry['last_modified']
+        response = self.api_client.get(
+            f'/api/templates/{template_id}',
+            parse_json=False,
+            headers=headers
+        )
+        if response.status_code == 304 and cache_entry:
+            return self._entry_info(cache_entry)
+        template_info = response.json()
         updated_at = template_info['updated_at']
+        validators = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified')
+        }
 
         # 检查缓存
-        cache_entry = self.template_cache.get(template_id)
-        if cache_entry:
-            # 将时间字符串转换为datetime对象进行比较
-            cache_time = datetime.fromisoformat(cache_entry['updated_at'])
-            new_time = datetime.fromisoformat(updated_at)
-            if cache_time >= new_time:
-                return {
-                    'path': cache_entry['path'],
-                    'dir_name': cache_entry['dir_name']
-                }
+        if cache_entry and self._is_up_to_date(cache_entry['updated_at'], updated_at):
+            cache_entry.update(validators)
+            return self._entry_info(cache_entry)
 
-        # 需要下载新模板
-        self._download_template(template_id, updated_at)
+        # 需要下载新模板；同一个模板同时只由一个线程（进程）下载，其他线程等待后直接使用下载结果
+        with self._template_lock(template_id):
+            cache_entry = self._load_template(template_id, updated_at)
+            cache_entry.update(validators)
+            return self._entry_info(cache_entry)
+
+    def get_cached_template(self, template_id: int) -> Optional[Dict[str, any]]:
+        """获取最近一次成功获取的模板信息，不发送任何请求
+
+        :param template_id: 模板ID
+        :return: 包含模板信息的字典 {'path': Path, 'dir_name': str}，没有缓存时返回 None
+        """
         cache_entry = self.template_cache.get(template_id)
+        return self._entry_info(cache_entry) if cache_entry else None
+
+    @staticmethod
+    def _entry_info(cache_entry: Dict) -> Dict[str, any]:
+        """从缓存条目中取出返回给调用者的模板信息"""
         return {
             'path': cache_entry['path'],
             'dir_name': cache_entry['dir_name']
         }
 
+    @staticmethod
+    def _is_up_to_date(cached_updated_at: str, updated_at: str) -> bool:
+        """检查缓存的模板是否不旧于服务端的模板
+
+        :param cached_updated_at: 缓存的模板的更新时间
+        :param updated_at: 服务端的模板的更新时间
+        :return: 缓存的模板是否可以直接使用
+        """
+        # 模板通常没有更新，时间字符串完全相同时不必解析；否则转换为datetime对象进行比较，
+        # 以正确处理时区和小数秒写法不同的时间字符串
+        return cached_updated_at == updated_at or (
+            datetime.fromisoformat(cached_updated_at) >= datetime.fromisoformat(updated_at)
+        )
+
+    @contextlib.contextmanager
+    def _template_lock(self, template_id: int) -> Iterator[None]:
+        """获取模板的锁，线程锁在当前进程内互斥，文件锁在共用缓存目录的各个工作进程之间互斥
+
+        :param template_id: 模板ID
+        """
+        with self._locks_guard:
+            lock = self._locks.setdefault(template_id, threading.Lock())
+        with lock, FileLock(self.cache_dir / f'{template_id}.lock'):
+            yield
+
+    @contextlib.contextmanager
+    def reading(self, template_id: int) -> Iterator[None]:
+        """复制模板期间持有的共享锁，持有期间模板不会被替换（包括其他工作进程中的替换）
+
+        :param template_id: 模板ID
+        """
+        with open(self.cache_dir / f'{template_id}.readers.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_SH)
+            yield
+
+    def _load_template(self, template_id: int, updated_at: str) -> Dict:
+        """获取不旧于 `updated_at` 的模板缓存条目，必须在持有模板的锁时调用
+
+        等待锁的期间其他线程或工作进程可能已经下载了这个模板，此时直接使用它们的下载结果。
+
+        :param template_id: 模板ID
+        :param updated_at: 模板更新时间
+        :return: 模板缓存条目
+        """
+        cache_entry = self.template_cache.get(template_id)
+        if cache_entry and self._is_up_to_date(cache_entry['updated_at'], updated_at):
+            return cache_entry
+
+        try:
+            stamp = json.loads((self.cache_dir / f'{template_id}.json').read_text())
+            content_dir = self.cache_dir / str(template_id) / stamp['name']
+            if self._is_up_to_date(stamp['updated_at'], updated_at) and content_dir.is_dir():
+                cache_entry = {
+                    'updated_at': stamp['updated_at'],
+                    'path': content_dir,
+                    'dir_name': stamp['dir_name']
+                }
+                self.template_cache[template_id] = cache_entry
+                return cache_entry
+        except (OSError, ValueError, KeyError):
+            # 没有其他工作进程下载过这个模板，或者记录已经损坏
+            pass
+
+        self._download_template(template_id, updated_at)
+        return self.template_cache[template_id]
+
     def _download_template(self, template_id: int, updated_at: str) -> Path:
-        """下载并解压模板
+        """下载并解压模板，必须在持有模板的锁时调用
+
+        模板先解压到临时目录，检查通过后再替换缓存目录中的旧模板，
+        下载或解压失败时不会留下不完整的模板。
 
         :param template_id: 模板ID
         :param updated_at: 模板更新时间
         :return: 解压后的模板目录路径
         """
-        # 准备目录
-        template_dir = self.cache_dir / str(template_id)
-        if template_dir.exists():
-            shutil.rmtree(template_dir)
-        template_dir.mkdir()
-
-        # 下载模板zip文件
-        zip_path = template_dir / 'template.zip'
+        # 下载模板zip文件，较小的模板只在内存中缓冲，不必先写入磁盘再读出来解压
         response = self.api_client.get(
             f'/api/templates/{template_id}/download',
             parse_json=False,
-            stream=True
+            stream=True,
+            # ZIP 文件本身已经压缩过，不需要 HTTP 层再压缩一次
+            headers={'Accept-Encoding': 'identity'}
         )
 
-        # 将响应内容写入文件
-        with open(zip_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-
-        # 解压模板到唯一目录
-        extracted_dir = template_dir
-        shutil.unpack_archive(str(zip_path), str(extracted_dir))
-        zip_path.unlink()
-        contents = list(extracted_dir.iterdir())
-        if len(contents) > 1:
-            raise RuntimeError(
-                f'a template can only contain one directory, but {contents} are found'
-            )
-        content_dir = contents[0]
-        content_dir_name = content_dir.stem
+        # 解压模板到临时目录
+        staging_dir = Path(tempfile.mkdtemp(prefix=f'.{template_id}-', dir=self.cache_dir))
+        try:
+            with tempfile.SpooledTemporaryFile(max_size=64 * 1024 * 1024) as zip_buffer:
+                response.raw.decode_content = True
+                shutil.copyfileobj(response.raw, zip_buffer, length=1024 * 1024)
+                zip_buffer.seek(0)
+                with zipfile.ZipFile(zip_buffer) as zip_file:
+                    zip_file.extractall(staging_dir)
+            contents = list(staging_dir.iterdir())
+            if len(contents) > 1:
+                raise RuntimeError(
+                    f'a template can only contain one directory, but {contents} are found'
+                )
+            content_dir_name = contents[0].stem
+        except BaseException:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+
+        # 用重命名替换旧模板：非空目录不能直接被覆盖，先把旧模板移开，替换完成后再删除。
+        # 替换时独占读者锁，等待正在复制旧模板的评测完成；替换之后旧模板不再能通过路径访问，
+        # 释放锁之后再删除它
+        template_dir = self.cache_dir / str(template_id)
+        old_dir = None
+        with open(self.cache_dir / f'{template_id}.readers.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if template_dir.exists():
+                old_dir = self.cache_dir / f'.{template_id}-old-{uuid.uuid4().hex}'
+                os.replace(template_dir, old_dir)
+            os.replace(staging_dir, template_dir)
+        content_dir = template_dir / contents[0].name
+        if old_dir is not None:
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+        # 记录模板版本，其他工作进程拿到锁之后可以直接使用这个模板
+        stamp_path = self.cache_dir / f'{template_id}.json'
+        temp_stamp_path = self.cache_dir / f'.{template_id}.json.{os.getpid()}'
+        temp_stamp_path.write_text(
+            json.dumps({
+                'updated_at': updated_at,
+                'name': content_dir.name,
+                'dir_name': content_dir_name
+            })
+        )
+        os.replace(temp_stamp_path, stamp_path)
 
         # 更新缓存
         self.template_cache[template_id] = {
@@ -96,7 +228,7 @@ class TemplateManager:
             'dir_name': content_dir_name
         }
 
-        return extracted_dir
+        return template_dir
 
     def clear_cache(self):
         """清空所有模板缓存"""
@@ -1,11 +1,35 @@
 from pathlib import Path
+import base64
 import json
+import threading
+import time
 import requests
 from filelock import FileLock
 from flask import current_app
 from typing import Optional, Dict
 
 
+# access_token 在过期前这么多秒就主动刷新，避免请求发出时令牌恰好过期
+REFRESH_MARGIN = 30
+
+
+def _token_expiry(token: str) -> Optional[float]:
+    """
+    读取 JWT 中的过期时间（`exp` 字段），只解码不验证签名
+
+    :param token: JWT
+    :return: 过期时间的 UNIX 时间戳，无法解码或没有过期时间时返回 None
+    """
+    try:
+        payload = token.split('.')[1]
+        # base64url 编码的 JWT 省略了末尾的填充
+        payload += '=' * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload))['exp']
+        return float(exp)
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
 class TokenManager:
     """JWT令牌管理器，用于管理节点与Web服务端的认证"""
 
@@ -13,6 +37,10 @@ class TokenManager:
         self.node_type = node_type
         self.token_file = Path(f'/tmp/oj_judger_{node_type}_tokens.json')
         self.lock = FileLock(f'{self.token_file}.lock')
+        # 内存中缓存的令牌，避免每次请求都加锁读取令牌文件
+        self._tokens: Optional[Dict] = None
+        # 保证同一进程中同一时间只有一个线程在登录或刷新令牌
+        self._refresh_lock = threading.Lock()
 
     def get_web_base_url(self) -> str:
         """获取Web服务端基础URL"""
@@ -33,6 +61,7 @@ class TokenManager:
         """保存令牌到文件(带文件锁)"""
         with self.lock:
             self.token_file.write_text(json.dumps(tokens))
+        self._tokens = tokens
 
     def _login(self) -> Dict:
         """初始登录获取令牌"""
@@ -49,12 +78,14 @@ class TokenManager:
         self._save_tokens(tokens)
         return tokens
 
-    def refresh_tokens(self):
-        """刷新JWT令牌并保存结果"""
-        tokens = self._load_tokens()
+    def _refresh(self, tokens: Optional[Dict]) -> Dict:
+        """用 refresh_token 刷新令牌，没有 refresh_token 或刷新失败时重新登录
+
+        :param tokens: 当前的令牌
+        :return: 新的令牌
+        """
         if not tokens or 'refresh_token' not in tokens:
-            self._login()
-            return
+            return self._login()
 
         refresh_url = f'{self.get_web_base_url()}/refresh'
         try:
@@ -63,14 +94,53 @@ class TokenManager:
                 headers={'Authorization': f'Bearer {tokens["refresh_token"]}'}
             )
             response.raise_for_status()
-            self._save_tokens(response.json())
+            tokens = response.json()
+            self._save_tokens(tokens)
+            return tokens
         except requests.RequestException:
             # 刷新失败时尝试重新登录
-            self._login()
+            return self._login()
+
+    def refresh_tokens(self, stale_token: Optional[str] = None):
+        """刷新JWT令牌并保存结果
+
+        同时有多个请求因为令牌失效而失败时，只有第一个请求会刷新令牌，其他请求等待并直接使用刷新后的令牌。
+
+        :param stale_token: 已经失效的 access_token，如果当前的令牌已经不是它，说明其他线程或进程已经刷新过
+        """
+        with self._refresh_lock:
+            if stale_token is not None:
+                tokens = self._tokens
+                if tokens is not None and tokens['access_token'] != stale_token:
+                    return
+            tokens = self._load_tokens()
+            if (stale_token is not None and tokens is not None
+                    and tokens['access_token'] != stale_token):
+                self._tokens = tokens
+                return
+            self._refresh(tokens)
+
+    @staticmethod
+    def _expires_soon(tokens: Dict) -> bool:
+        """判断 access_token 是否即将过期，无法得知过期时间时认为不会过期"""
+        expiry = _token_expiry(tokens['access_token'])
+        return expiry is not None and expiry - time.time() < REFRESH_MARGIN
 
     def get_access_token(self) -> str:
-        """获取有效的access_token"""
-        tokens = self._load_tokens() or self._login()
+        """获取有效的access_token，即将过期时主动刷新"""
+        tokens = self._tokens
+        if tokens is None or self._expires_soon(tokens):
+            # 加锁后再检查一次，其他线程可能已经登录或刷新过
+            with self._refresh_lock:
+                tokens = self._tokens
+                if tokens is None or self._expires_soon(tokens):
+                    # 其他进程可能已经刷新过令牌，先从文件中读取
+                    tokens = self._load_tokens()
+                    if tokens is None:
+                        tokens = self._login()
+                    elif self._expires_soon(tokens):
+                        tokens = self._refresh(tokens)
+                    self._tokens = tokens
         return tokens['access_token']
 
     def get_refresh_token(self) -> str:
@@ -0,0 +1,34 @@
+"""
+WSGI 服务模块
+
+用 gunicorn 在生产模式下运行管理节点或执行节点的 Flask 应用。
+只有生产模式才会导入这个模块，调试模式不需要加载 gunicorn。
+"""
+
+from typing import Optional, Dict, Any
+import gunicorn.app.base
+from flask import Flask
+
+
+class StandaloneApplication(gunicorn.app.base.BaseApplication):
+    """直接运行给定 Flask 应用对象的 gunicorn 应用"""
+
+    def __init__(self, app: Flask, options: Optional[Dict[str, Any]] = None):
+        """
+        :param app: 要运行的 Flask 应用
+        :param options: gunicorn 配置项
+        """
+        self.options = options or {}
+        self.application = app
+        super().__init__()
+
+    def load_config(self):
+        config = {
+            key: value for key, value in self.options.items()
+            if key in self.cfg.settings and value is not None
+        }
+        for key, value in config.items():
+            self.cfg.set(key.lower(), value)
+
+    def load(self) -> Flask:
+        return self.application
@@ -0,0 +1,26 @@
+from judger.utils.dir_reaper import DirectoryReaper, GRAVEYARD_NAME
+
+
+def test_discard_removes_directory(tmp_path):
+    """测试目录被立即移走并在后台删除"""
+    target = tmp_path / 'judgement_for_1'
+    (target / 'build').mkdir(parents=True)
+    (target / 'build' / 'a.o').write_bytes(b'0')
+    reaper = DirectoryReaper()
+    reaper.discard(target)
+    assert not target.exists()
+    reaper.join()
+    assert list((tmp_path / GRAVEYARD_NAME).iterdir()) == []
+
+
+def test_sweep_only_removes_own_leftovers(tmp_path):
+    """测试启动时只清理待删除目录中遗留的目录，不删除其他程序的文件"""
+    leftover = tmp_path / GRAVEYARD_NAME / 'judgement_for_2-0123'
+    leftover.mkdir(parents=True)
+    unrelated = tmp_path / 'other.gc-0123'
+    unrelated.mkdir()
+    reaper = DirectoryReaper()
+    reaper.sweep(tmp_path)
+    reaper.join()
+    assert not leftover.exists()
+    assert unrelated.exists()
@@ -0,0 +1,134 @@
+import sqlite3
+import threading
+import pytest
+from judger.manager import distribute
+
+
+@pytest.fixture
+def db_conn(manager_app):
+    """清空任务队列和执行节点表，返回一个分发脚本使用的数据库连接"""
+    db_path = manager_app.config['SQLALCHEMY_DATABASE_URI'].split('///')[1]
+    conn = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+    conn.execute('DELETE FROM tasks')
+    conn.execute('DELETE FROM executors')
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def add_executors(conn, n, idle=True, is_alive=True):
+    """添加 n 个执行节点"""
+    conn.executemany(
+        "INSERT INTO executors (ip, data, last_updated, idle, is_alive) "
+        "VALUES (?, '{}', CURRENT_TIMESTAMP, ?, ?)",
+        [(f'10.0.0.{i + 1}', idle, is_alive) for i in range(n)]
+    )
+    conn.commit()
+
+
+def add_tasks(conn, judgment_ids):
+    """按顺序将评测任务加入队列"""
+    conn.executemany('INSERT INTO tasks (judgment_id) VALUES (?)', [(i,) for i in judgment_ids])
+    conn.commit()
+
+
+def test_dispatch_assigns_oldest_tasks(db_conn, monkeypatch):
+    """测试每个空闲节点分配一个最早的任务，节点被标记为忙碌"""
+    sent = []
+    monkeypatch.setattr(
+        distribute, 'send_task', lambda task, executor: sent.append((task[1], executor[1])) or True
+    )
+    add_executors(db_conn, 2)
+    add_tasks(db_conn, [101, 102, 103])
+
+    assert distribute.dispatch(db_conn)
+    assert sorted(sent) == [(101, '10.0.0.1'), (102, '10.0.0.2')]
+    assert db_conn.execute('SELECT judgment_id FROM tasks').fetchall() == [(103,)]
+    assert db_conn.execute('SELECT COUNT(*) FROM executors WHERE idle=1').fetchone() == (0,)
+    # 没有空闲节点时不分配任务
+    assert not distribute.dispatch(db_conn)
+    assert len(sent) == 2
+
+
+def test_failed_send_requeues_task(db_conn, monkeypatch):
+    """测试发送失败的任务以原来的 ID 放回队列，失败的节点被删除"""
+    monkeypatch.setattr(distribute, 'send_task', lambda task, executor: executor[1] != '10.0.0.1')
+    add_executors(db_conn, 2)
+    add_tasks(db_conn, [101, 102, 103])
+    task_ids = dict(db_conn.execute('SELECT judgment_id, id FROM tasks').fetchall())
+
+    assert distribute.dispatch(db_conn)
+    tasks = db_conn.execute('SELECT id, judgment_id FROM tasks ORDER BY id').fetchall()
+    # 放回的任务仍然排在还没分配的任务之前
+    assert tasks == [(task_ids[101], 101), (task_ids[103], 103)]
+    executors = db_conn.execute('SELECT ip, idle FROM executors').fetchall()
+    assert executors == [('10.0.0.2', 0)]
+
+
+def test_dispatch_skips_offline_executors(db_conn, monkeypatch):
+    """测试不向不在线的节点分配任务"""
+    monkeypatch.setattr(distribute, 'send_task', lambda task, executor: True)
+    add_executors(db_conn, 1, is_alive=False)
+    add_tasks(db_conn, [101])
+
+    assert not distribute.dispatch(db_conn)
+    assert db_conn.execute('SELECT judgment_id FROM tasks').fetchall() == [(101,)]
+
+
+def test_failed_send_requeued_after_new_task(manager_app, db_conn, monkeypatch):
+    """测试发送失败期间有新任务加入队列时，失败的任务仍以原来的 ID 放回队列且排在新任务之前"""
+    db_path = manager_app.config['SQLALCHEMY_DATABASE_URI'].split('///')[1]
+
+    def send_task(task, executor):
+        # 队列已经被取空，此时管理节点收到了新的评测请求
+        conn = sqlite3.connect(db_path, timeout=10)
+        conn.execute('INSERT INTO tasks (judgment_id) VALUES (202)')
+        conn.commit()
+        conn.close()
+        return False
+
+    monkeypatch.setattr(distribute, 'send_task', send_task)
+    add_executors(db_conn, 1)
+    add_tasks(db_conn, [201])
+    [(task_id,)] = db_conn.execute('SELECT id FROM tasks').fetchall()
+
+    assert distribute.dispatch(db_conn)
+    tasks = db_conn.execute('SELECT id, judgment_id FROM tasks ORDER BY id').fetchall()
+    assert tasks[0] == (task_id, 201)
+    assert [judgment_id for _, judgment_id in tasks] == [201, 202]
+    assert db_conn.execute('SELECT COUNT(*) FROM executors').fetchone() == (0,)
+
+
+def test_concurrent_dispatch_does_not_double_claim(manager_app, db_conn, monkeypatch):
+    """测试两个连接同时分发任务时，每个任务只被发送一次，每个执行节点只分配一个任务"""
+    sent = []
+    sent_lock = threading.Lock()
+
+    def send_task(task, executor):
+        with sent_lock:
+            sent.append((task[1], executor[1]))
+        return True
+
+    monkeypatch.setattr(distribute, 'send_task', send_task)
+    add_executors(db_conn, 4)
+    add_tasks(db_conn, range(100, 108))
+
+    db_path = manager_app.config['SQLALCHEMY_DATABASE_URI'].split('///')[1]
+    barrier = threading.Barrier(2)
+
+    def run():
+        conn = sqlite3.connect(db_path, timeout=10)
+        barrier.wait()
+        distribute.dispatch(conn)
+        conn.close()
+
+    threads = [threading.Thread(target=run) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    judgment_ids = sorted(judgment_id for judgment_id, _ in sent)
+    assert judgment_ids == list(range(100, 104))
+    assert sorted(ip for _, ip in sent) == [f'10.0.0.{i}' for i in range(1, 5)]
+    assert db_conn.execute('SELECT COUNT(*) FROM tasks').fetchone() == (4,)
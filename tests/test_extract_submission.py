@@ -0,0 +1,52 @@
+import io
+import zipfile
+from judger.executor import _extract_submission
+
+
+def make_zip(files):
+    """构造包含指定文件的 ZIP 文件，`files` 为 {ZIP 中的路径: 内容}"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zip_file:
+        for name, content in files.items():
+            zip_file.writestr(name, content)
+    buffer.seek(0)
+    return zipfile.ZipFile(buffer)
+
+
+def test_overwrite_template_files(tmp_path):
+    """测试提交的文件覆盖模板中的同名文件，新目录被创建"""
+    (tmp_path / 'src').mkdir()
+    (tmp_path / 'src' / 'main.cpp').write_text('template')
+    with make_zip({'src/main.cpp': 'submission', 'src/new/util.h': 'util'}) as zip_file:
+        _extract_submission(zip_file, tmp_path)
+
+    assert (tmp_path / 'src' / 'main.cpp').read_text() == 'submission'
+    assert (tmp_path / 'src' / 'new' / 'util.h').read_text() == 'util'
+
+
+def test_paths_stay_inside_extract_dir(tmp_path):
+    """测试绝对路径和 `..` 被去掉，文件不会被解压到评测目录之外"""
+    extract_dir = tmp_path / 'judgment'
+    extract_dir.mkdir()
+    with make_zip({'../escape.cpp': 'a', '/abs/path.cpp': 'b', './src/../x.cpp': 'c'}) as zip_file:
+        _extract_submission(zip_file, extract_dir)
+
+    assert not (tmp_path / 'escape.cpp').exists()
+    assert (extract_dir / 'escape.cpp').read_text() == 'a'
+    assert (extract_dir / 'abs' / 'path.cpp').read_text() == 'b'
+    assert (extract_dir / 'src' / 'x.cpp').read_text() == 'c'
+
+
+def test_symlink_in_template_not_followed(tmp_path):
+    """测试模板中的符号链接被替换为普通文件，不会通过它写入评测目录之外的文件"""
+    outside = tmp_path / 'outside.cpp'
+    outside.write_text('outside')
+    extract_dir = tmp_path / 'judgment'
+    extract_dir.mkdir()
+    (extract_dir / 'main.cpp').symlink_to(outside)
+    with make_zip({'main.cpp': 'submission'}) as zip_file:
+        _extract_submission(zip_file, extract_dir)
+
+    assert outside.read_text() == 'outside'
+    assert not (extract_dir / 'main.cpp').is_symlink()
+    assert (extract_dir / 'main.cpp').read_text() == 'submission'
@@ -0,0 +1,188 @@
+import json
+from collections import OrderedDict
+import pytest
+import judger.executor  # noqa: F401  先导入执行节点包，避免循环导入
+from judger.executor import function_extractor
+from judger.executor.function_extractor import FunctionExtractor, extract_function_implementations
+from judger.executor.function_types import FunctionParameter, FunctionSignature
+
+try:
+    function_extractor._get_index()
+except Exception:
+    pytest.skip('libclang is not available', allow_module_level=True)
+
+
+SOURCE = '''struct Shape {
+    double area(int n) const noexcept;
+};
+
+double Shape::area(int n) const noexcept {
+    return n * 2.0;
+}
+
+auto twice(int x) -> int { return x * 2; }
+
+int declared_only(int x);
+'''
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    """只有一个源文件的项目，构建目录中有 compile_commands.json"""
+    source_file = tmp_path / 'src' / 'shape.cpp'
+    source_file.parent.mkdir()
+    source_file.write_text(SOURCE)
+    build_dir = tmp_path / 'build'
+    build_dir.mkdir()
+    (build_dir / 'compile_commands.json').write_text(json.dumps([{
+        'directory': str(build_dir),
+        'command': f'clang++ -std=c++17 -o shape.o -c {source_file}',
+        'file': str(source_file)
+    }]))
+    # 测试用的源文件不包含标准库头文件，不需要 clang++ 和预编译头文件
+    monkeypatch.setattr(FunctionExtractor, '_get_system_include_paths', lambda self: [])
+    monkeypatch.setattr(function_extractor, '_get_prelude_pch', lambda index, args, toolchain: None)
+    # 每个测试都从空的提取结果缓存开始
+    monkeypatch.setattr(function_extractor, '_implementation_cache', OrderedDict())
+    return source_file, build_dir
+
+
+def signature(return_type, name, *parameters):
+    return FunctionSignature(
+        return_type, name, tuple(FunctionParameter(n, t) for n, t in parameters)
+    )
+
+
+def test_extract_const_noexcept_method(project):
+    """测试提取类外定义的 const noexcept 成员函数"""
+    source_file, build_dir = project
+    [implementation] = extract_function_implementations(
+        source_file, [signature('double', 'Shape::area', ('n', 'int'))], build_dir
+    )
+    assert implementation == (
+        'double Shape::area(int n) const noexcept {\n    return n * 2.0;\n}'
+    )
+
+
+def test_extract_trailing_return_function(project):
+    """测试提取使用尾置返回类型的函数"""
+    source_file, build_dir = project
+    [implementation] = extract_function_implementations(
+        source_file, [signature('int', 'twice', ('x', 'int'))], build_dir
+    )
+    assert implementation == 'auto twice(int x) -> int { return x * 2; }'
+
+
+def test_declaration_only_function_not_found(project):
+    """测试只有声明没有定义的函数提取结果为 None，不影响同一文件中的其他函数"""
+    source_file, build_dir = project
+    implementations = extract_function_implementations(
+        source_file,
+        [signature('int', 'declared_only', ('x', 'int')), signature('int', 'twice', ('x', 'int'))],
+        build_dir
+    )
+    assert implementations[0] is None
+    assert implementations[1] == 'auto twice(int x) -> int { return x * 2; }'
+
+
+def test_stale_precompiled_header_discarded(project, tmp_path, monkeypatch):
+    """测试无法使用的 PCH 被删除，源文件不使用 PCH 重新解析"""
+    source_file, build_dir = project
+    pch_path = tmp_path / 'stale.pch'
+    pch_path.write_bytes(b'not a precompiled header')
+    monkeypatch.setattr(
+        function_extractor, '_get_prelude_pch', lambda index, args, toolchain: pch_path
+    )
+
+    [implementation] = extract_function_implementations(
+        source_file, [signature('int', 'twice', ('x', 'int'))], build_dir
+    )
+    assert implementation == 'auto twice(int x) -> int { return x * 2; }'
+    assert not pch_path.exists()
+
+
+def test_fatal_error_with_precompiled_header_falls_back(project, tmp_path, monkeypatch):
+    """测试使用 PCH 解析时出现致命错误，PCH 被删除，源文件不使用 PCH 重新解析"""
+    source_file, build_dir = project
+    pch_path = tmp_path / 'stale.pch'
+    pch_path.write_bytes(b'')
+    monkeypatch.setattr(
+        function_extractor, '_get_prelude_pch', lambda index, args, toolchain: pch_path
+    )
+    real_index = function_extractor._get_index()
+
+    class StaleIndex:
+        """模拟 libclang 把过期的 PCH 报告为致命错误而不是解析失败"""
+
+        def parse(self, path, args, **kwargs):
+            if args[0] == '-include-pch':
+                args = ['-include', str(tmp_path / 'missing.h'), *args[2:]]
+            return real_index.parse(path=path, args=args, **kwargs)
+
+    extractor = function_extractor._get_extractor(build_dir)
+    monkeypatch.setattr(extractor, 'index', StaleIndex())
+
+    [implementation] = extract_function_implementations(
+        source_file, [signature('int', 'twice', ('x', 'int'))], build_dir
+    )
+    assert implementation == 'auto twice(int x) -> int { return x * 2; }'
+    assert not pch_path.exists()
+
+
+def test_type_names_not_shared_between_files(project):
+    """测试类型名称只在各自的源文件中解析，不会沿用另一个源文件的解析结果"""
+    source_file, build_dir = project
+    other_file = source_file.with_name('number.cpp')
+    other_file.write_text('using Number = int;\nNumber one(Number x) { return x; }\n')
+    commands = json.loads((build_dir / 'compile_commands.json').read_text())
+    commands.append({
+        'directory': str(build_dir),
+        'command': f'clang++ -std=c++17 -o number.o -c {other_file}',
+        'file': str(other_file)
+    })
+    (build_dir / 'compile_commands.json').write_text(json.dumps(commands))
+
+    number_twice = signature('Number', 'twice', ('x', 'Number'))
+    [implementation] = extract_function_implementations(
+        other_file, [signature('Number', 'one', ('x', 'Number'))], build_dir
+    )
+    assert implementation == 'Number one(Number x) { return x; }'
+    # shape.cpp 中没有 Number 类型，不能按 number.cpp 中的 int 匹配 twice
+    assert extract_function_implementations(source_file, [number_twice], build_dir) == [None]
+
+
+def test_cache_shared_between_project_dirs(project, tmp_path, monkeypatch):
+    """测试同一份代码在另一个评测目录中重新评测时直接使用缓存，不再解析源文件"""
+    source_file, build_dir = project
+    twice = signature('int', 'twice', ('x', 'int'))
+    [implementation] = extract_function_implementations(source_file, [twice], build_dir)
+
+    # 复制到另一个评测目录，编译命令中的路径也随之改变
+    other_dir = tmp_path / 'judgement_for_2'
+    (other_dir / 'src').mkdir(parents=True)
+    (other_dir / 'build').mkdir()
+    other_source = other_dir / 'src' / 'shape.cpp'
+    other_source.write_text(SOURCE)
+    (other_dir / 'build' / 'compile_commands.json').write_text(json.dumps([{
+        'directory': str(other_dir / 'build'),
+        'command': f'clang++ -std=c++17 -I{other_dir / "src"} -o shape.o -c {other_source}',
+        'file': str(other_source)
+    }]))
+    (build_dir / 'compile_commands.json').write_text(json.dumps([{
+        'directory': str(build_dir),
+        'command': f'clang++ -std=c++17 -I{source_file.parent} -o shape.o -c {source_file}',
+        'file': str(source_file)
+    }]))
+    assert extract_function_implementations(source_file, [twice], build_dir) == [implementation]
+
+    def fail_parse(*args, **kwargs):
+        raise AssertionError('source file parsed again')
+
+    monkeypatch.setattr(FunctionExtractor, '_parse', fail_parse)
+    assert extract_function_implementations(
+        other_source, [twice], other_dir / 'build'
+    ) == [implementation]
+    # 依赖的项目文件被修改后不再使用缓存
+    other_source.write_text(SOURCE + '\n// changed\n')
+    with pytest.raises(RuntimeError):
+        extract_function_implementations(other_source, [twice], other_dir / 'build')
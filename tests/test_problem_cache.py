@@ -0,0 +1,54 @@
+import pytest
+from judger.executor import create_app, _get_problem_data
+from judger.executor.config import Config
+
+
+class FakeAPIClient:
+    def __init__(self):
+        self.requests = []
+
+    def get(self, endpoint):
+        self.requests.append(endpoint)
+        return {'endpoint': endpoint}
+
+
+@pytest.fixture
+def executor_app(tmp_path, monkeypatch):
+    """临时目录和日志目录都在 tmp_path 中的执行节点应用"""
+    monkeypatch.setattr(Config, 'TMP_DIR', str(tmp_path / 'tmp'))
+    monkeypatch.setattr(Config, 'LOG_DIR', str(tmp_path / 'log'))
+    app = create_app({'TESTING': True, 'PROBLEM_CACHE_TTL': 300, 'PROBLEM_CACHE_SIZE': 2})
+    with app.app_context():
+        yield app
+
+
+def test_cached_until_expired(executor_app, monkeypatch):
+    """测试缓存时间内重复使用题目信息，过期后重新请求"""
+    api_client = FakeAPIClient()
+    now = [1000.0]
+    monkeypatch.setattr('judger.executor.time.monotonic', lambda: now[0])
+
+    assert _get_problem_data(api_client, 1, '/api/problems/1') == {'endpoint': '/api/problems/1'}
+    _get_problem_data(api_client, 1, '/api/problems/1')
+    assert api_client.requests == ['/api/problems/1']
+
+    now[0] += 301
+    _get_problem_data(api_client, 1, '/api/problems/1')
+    assert api_client.requests == ['/api/problems/1'] * 2
+
+
+def test_expired_and_least_recently_used_evicted(executor_app, monkeypatch):
+    """测试写入时淘汰过期的题目，题目数超出上限时淘汰最久未使用的题目"""
+    api_client = FakeAPIClient()
+    now = [1000.0]
+    monkeypatch.setattr('judger.executor.time.monotonic', lambda: now[0])
+
+    _get_problem_data(api_client, 1, '/api/problems/1')
+    now[0] += 301
+    _get_problem_data(api_client, 2, '/api/problems/2')
+    assert list(executor_app.problem_cache) == [2]
+
+    _get_problem_data(api_client, 3, '/api/problems/3')
+    _get_problem_data(api_client, 2, '/api/problems/2')
+    _get_problem_data(api_client, 4, '/api/problems/4')
+    assert list(executor_app.problem_cache) == [2, 4]
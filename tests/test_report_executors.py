@@ -1,6 +1,8 @@
 import json
 import pytest  # noqa: F401
-from judger.manager.models import Executor
+from sqlalchemy import update
+from judger.manager import _find_executor
+from judger.manager.models import db, Executor
 
 
 def test_empty_request(manager_client):
@@ -71,3 +73,67 @@ def test_continuous_status_update(manager_client):
     assert len(records) == 1
     stored_data = json.loads(records[0].data)
     assert stored_data["is_alive"] is True
+
+
+def report_status(manager_client, ip, is_alive=True):
+    """以指定 IP 的执行节点身份上报状态"""
+    return manager_client.post(
+        '/api/judge/executors',
+        json={"hostname": ip, "is_alive": is_alive},
+        environ_base={'REMOTE_ADDR': ip}
+    )
+
+
+def test_status_update_preserves_idle(manager_client):
+    """测试状态更新不会改变执行节点的空闲状态和 ID"""
+    assert report_status(manager_client, '10.1.0.1').status_code == 200
+    executor = Executor.query.filter_by(ip='10.1.0.1').one()
+    executor_id = executor.id
+    executor.idle = False
+    db.session.commit()
+
+    assert report_status(manager_client, '10.1.0.1', is_alive=False).status_code == 200
+    db.session.expire_all()
+    executor = Executor.query.filter_by(ip='10.1.0.1').one()
+    assert executor.id == executor_id
+    assert executor.idle is False
+    assert executor.is_alive is False
+
+
+def test_find_executor_after_ip_changed(manager_app, manager_client):
+    """测试缓存的节点 ID 被分配给其他 IP 的节点后，按 IP 重新查找"""
+    assert report_status(manager_client, '10.1.0.2').status_code == 200
+    executor_id = manager_app.executor_ids['10.1.0.2']
+    # 节点被删除后，它的 ID 被分配给了另一个 IP 的节点
+    db.session.execute(
+        update(Executor).where(Executor.id == executor_id).values(ip='10.1.0.3')
+    )
+    db.session.commit()
+    db.session.expire_all()
+
+    assert _find_executor('10.1.0.2') is None
+    assert '10.1.0.2' not in manager_app.executor_ids
+    assert _find_executor('10.1.0.3').id == executor_id
+    assert manager_app.executor_ids['10.1.0.3'] == executor_id
+
+
+def test_result_marks_executor_idle(manager_app, manager_client, monkeypatch):
+    """测试执行节点回报评测结果后被标记为空闲，结果交给后台转发"""
+    forwarded = []
+    monkeypatch.setattr(
+        manager_app.result_forwarder, 'submit', lambda *args: forwarded.append(args)
+    )
+    assert report_status(manager_client, '10.1.0.4').status_code == 200
+    executor = Executor.query.filter_by(ip='10.1.0.4').one()
+    executor.idle = False
+    db.session.commit()
+
+    response = manager_client.post(
+        '/api/judge/7/result',
+        json={"result": "AC", "log": "ok"},
+        environ_base={'REMOTE_ADDR': '10.1.0.4'}
+    )
+    assert response.status_code == 200
+    db.session.expire_all()
+    assert Executor.query.filter_by(ip='10.1.0.4').one().idle is True
+    assert forwarded == [(7, {"result": "AC", "log": "ok"}, None)]
@@ -0,0 +1,129 @@
+import io
+import threading
+import zipfile
+import pytest
+import judger.executor  # noqa: F401  先导入执行节点包，避免 template_manager 的循环导入
+from judger.executor.config import Config
+from judger.utils.template_manager import TemplateManager
+
+
+def make_template_zip(content):
+    """构造只包含一个项目目录的模板 ZIP 文件"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zip_file:
+        zip_file.writestr('project/CMakeLists.txt', content)
+    return buffer.getvalue()
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, json_data=None, body=b'', headers=None):
+        self.status_code = status_code
+        self.json_data = json_data
+        self.headers = headers or {}
+        self.raw = io.BytesIO(body)
+
+    def json(self):
+        return self.json_data
+
+
+class FakeAPIClient:
+    """模拟 Web 服务端的模板接口，支持 ETag 条件请求"""
+
+    def __init__(self):
+        self.updated_at = '2024-01-01T00:00:00'
+        self.requests = []
+        self.downloads = 0
+
+    def get(self, path, parse_json=True, headers=None, stream=False):
+        headers = headers or {}
+        self.requests.append((path, headers))
+        etag = f'"{self.updated_at}"'
+        if path.endswith('/download'):
+            self.downloads += 1
+            return FakeResponse(body=make_template_zip(self.updated_at))
+        if headers.get('If-None-Match') == etag:
+            return FakeResponse(status_code=304)
+        return FakeResponse(
+            json_data={'updated_at': self.updated_at},
+            headers={'ETag': etag, 'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT'}
+        )
+
+
+@pytest.fixture
+def api_client(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'TMP_DIR', str(tmp_path))
+    return FakeAPIClient()
+
+
+def test_download_and_not_modified(api_client):
+    """测试第一次获取模板时下载，之后服务端返回 304 时直接使用缓存"""
+    manager = TemplateManager(api_client)
+    info = manager.get_template(1)
+    assert info['dir_name'] == 'project'
+    assert (info['path'] / 'CMakeLists.txt').read_text() == '2024-01-01T00:00:00'
+
+    assert manager.get_template(1) == info
+    assert api_client.downloads == 1
+    _, headers = api_client.requests[-1]
+    assert headers['If-None-Match'] == '"2024-01-01T00:00:00"'
+    assert headers['If-Modified-Since'] == 'Mon, 01 Jan 2024 00:00:00 GMT'
+
+
+def test_updated_template_replaced(api_client):
+    """测试模板更新后重新下载并替换旧模板，不留下临时目录"""
+    manager = TemplateManager(api_client)
+    manager.get_template(1)
+    api_client.updated_at = '2024-02-01T00:00:00'
+
+    info = manager.get_template(1)
+    assert api_client.downloads == 2
+    assert (info['path'] / 'CMakeLists.txt').read_text() == '2024-02-01T00:00:00'
+    assert sorted(path.name for path in manager.cache_dir.iterdir()) == [
+        '1', '1.json', '1.lock', '1.readers.lock'
+    ]
+
+
+def test_concurrent_requests_download_once(api_client):
+    """测试多个线程同时获取同一个模板时只下载一次"""
+    manager = TemplateManager(api_client)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(manager.get_template(1)))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert api_client.downloads == 1
+    assert len(results) == 4 and all(result == results[0] for result in results)
+
+
+def test_template_downloaded_by_other_process_reused(api_client):
+    """测试其他工作进程已经下载过的模板直接使用，不重复下载"""
+    TemplateManager(api_client).get_template(1)
+    info = TemplateManager(api_client).get_template(1)
+    assert api_client.downloads == 1
+    assert (info['path'] / 'CMakeLists.txt').read_text() == '2024-01-01T00:00:00'
+
+
+def test_template_not_replaced_while_reading(api_client):
+    """测试复制模板期间模板不会被替换，复制完成后才替换并删除旧模板"""
+    manager = TemplateManager(api_client)
+    old_path = manager.get_template(1)['path']
+    api_client.updated_at = '2024-02-01T00:00:00'
+
+    results = []
+    with manager.reading(1):
+        updater = threading.Thread(target=lambda: results.append(manager.get_template(1)))
+        updater.start()
+        updater.join(timeout=0.5)
+        # 替换等待读者锁，旧模板在复制期间一直可用
+        assert updater.is_alive()
+        assert (old_path / 'CMakeLists.txt').read_text() == '2024-01-01T00:00:00'
+    updater.join()
+
+    [info] = results
+    assert (info['path'] / 'CMakeLists.txt').read_text() == '2024-02-01T00:00:00'
+    assert not any(path.name.startswith('.') for path in manager.cache_dir.iterdir())
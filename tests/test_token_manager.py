@@ -0,0 +1,84 @@
+import base64
+import json
+import time
+import pytest
+from judger.utils import token_manager as token_manager_module
+from judger.utils.token_manager import TokenManager
+
+
+def make_token(exp):
+    """构造一个带过期时间的 JWT，签名部分不会被检查"""
+    payload = base64.urlsafe_b64encode(json.dumps({'exp': exp}).encode()).decode().rstrip('=')
+    return f'header.{payload}.signature'
+
+
+class FakeResponse:
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.tokens
+
+
+@pytest.fixture
+def token_manager(manager_app, tmp_path, monkeypatch):
+    """令牌保存在临时目录中的令牌管理器，记录它向 Web 服务端发出的请求"""
+    manager = TokenManager('test')
+    manager.token_file = tmp_path / 'tokens.json'
+    manager.lock = token_manager_module.FileLock(f'{manager.token_file}.lock')
+    manager.calls = []
+    manager.next_tokens = {}
+
+    def post(url, **kwargs):
+        manager.calls.append(url.rsplit('/', 1)[1])
+        return FakeResponse(manager.next_tokens)
+
+    monkeypatch.setattr(token_manager_module.requests, 'post', post)
+    return manager
+
+
+def test_login_when_no_tokens(token_manager):
+    """测试没有令牌时登录，之后直接使用内存中的令牌"""
+    access_token = make_token(time.time() + 3600)
+    token_manager.next_tokens = {'access_token': access_token, 'refresh_token': 'r1'}
+
+    assert token_manager.get_access_token() == access_token
+    assert token_manager.get_access_token() == access_token
+    assert token_manager.calls == ['login']
+    assert json.loads(token_manager.token_file.read_text())['access_token'] == access_token
+
+
+def test_refresh_when_token_expires_soon(token_manager):
+    """测试 access_token 即将过期时主动刷新"""
+    expiring_token = make_token(time.time() + token_manager_module.REFRESH_MARGIN / 2)
+    token_manager._save_tokens({'access_token': expiring_token, 'refresh_token': 'r1'})
+    new_token = make_token(time.time() + 3600)
+    token_manager.next_tokens = {'access_token': new_token, 'refresh_token': 'r2'}
+
+    assert token_manager.get_access_token() == new_token
+    assert token_manager.calls == ['refresh']
+
+
+def test_no_refresh_when_token_is_valid(token_manager):
+    """测试 access_token 离过期还早时不刷新"""
+    valid_token = make_token(time.time() + 3600)
+    token_manager._save_tokens({'access_token': valid_token, 'refresh_token': 'r1'})
+
+    assert token_manager.get_access_token() == valid_token
+    assert token_manager.calls == []
+
+
+def test_stale_token_refreshed_only_once(token_manager):
+    """测试多个请求因为同一个失效令牌而要求刷新时，只刷新一次"""
+    stale_token = make_token(time.time() + 3600)
+    token_manager._save_tokens({'access_token': stale_token, 'refresh_token': 'r1'})
+    new_token = make_token(time.time() + 3600 + 1)
+    token_manager.next_tokens = {'access_token': new_token, 'refresh_token': 'r2'}
+
+    token_manager.refresh_tokens(stale_token=stale_token)
+    token_manager.refresh_tokens(stale_token=stale_token)
+    assert token_manager.calls == ['refresh']
+    assert token_manager.get_access_token() == new_token